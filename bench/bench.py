@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+#
+# Reverse : reverse engineering for x86 binaries
+# Copyright (C) 2015    Joel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.    If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Run the decompilation of each binary in-process and time each phase
+# separately. Each function is analyzed in a forked process, so the peak
+# memory (ru_maxrss) is given per function. The child starts with the
+# memory of the parent, the resident memory at the fork is subtracted.
+#
+# ./bench/bench.py                       all tests/*.bin and bench/*.bin
+# ./bench/bench.py -o base.json          save the results
+# ./bench/bench.py -b base.json          compare with saved results
+# ./bench/bench.py tests/server.bin:connection_handler
+# ./bench/bench.py --startup             time of a new reverse.py process
+# ./bench/bench.py --passes              time of each pass over the ast
+
+import sys
+import os
+import io
+import json
+import glob
+import time
+import resource
+import subprocess
+from argparse import ArgumentParser
+
+REVPATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REVPATH)
+
+import lib.ast
+import lib.output
+from lib.context import DecompileContext
+from lib.disassembler import Disassembler
+from lib.generate_ast import generate_ast
+from lib.graph import get_rss
+
+
+PHASES = ["binary", "disasm", "extract", "graph", "ast", "print"]
+
+# Options of the analysis, like -nc -ns --forcejmp (don't stop on a
+# "jmp reg", for the switch tables)
+OPTIONS = {"nocolor": True, "nosectionsname": True, "forcejmp": True}
+
+# Set by --passes, the times of the passes are included in the phase ast
+TIME_PASSES = False
+
+# Options of reverse.py timed with --startup. The time includes the
+# python startup and the imports, so a slow import is seen here.
+STARTUP_MODES = [
+    ("sym", ["-s"]),
+    ("dump", ["--dump"]),
+    ("decompile", []),
+]
+STARTUP_FILES = ["tests/server.bin", "tests/pendu.bin"]
+
+
+def run(filename, entry):
+    res = {}
+    start_rss = get_rss()
+
+    def timed(phase, f, *args):
+        t = time.perf_counter()
+        ret = f(*args)
+        res[phase] = time.perf_counter() - t
+        return ret
+
+    lib.ast.time_passes = TIME_PASSES
+
+    dis = timed("binary", Disassembler, filename)
+    addr = dis.get_addr_from_string(entry)
+    timed("disasm", dis.disasm, addr, True)
+
+    gph = timed("extract", dis.extract_func, addr, OPTIONS["forcejmp"])
+    ctx = DecompileContext(dis, gph, OPTIONS)
+
+    timed("graph", gph.init, OPTIONS)
+
+    # The paths are consumed by generate_ast
+    if gph.paths is not None:
+        res["paths"] = len(gph.paths.paths)
+
+    ast = timed("ast", generate_ast, ctx)
+
+    timed("print", lib.output.print_ast, ctx, addr, ast, io.StringIO())
+
+    res["total"] = sum(res[p] for p in PHASES)
+    res["peak_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - \
+            start_rss
+    res["insts"] = len(dis.code)
+    res["blocks"] = len(gph.nodes)
+    res.setdefault("paths", 0)
+    res["loops"] = len(gph.loops)
+    res["explosion"] = gph.explosion
+    res["passes"] = ctx.pass_time
+    return res
+
+
+# Run the function in a child process, the result is sent with a pipe.
+# An exception in the child is returned as {"error": ...}
+def run_forked(filename, entry):
+    r, w = os.pipe()
+    pid = os.fork()
+
+    if pid == 0:
+        os.close(r)
+        sys.stderr = open(os.devnull, "w")
+        try:
+            res = run(filename, entry)
+        except BaseException as e:
+            res = {"error": "%s: %s" % (type(e).__name__, e)}
+        os.write(w, json.dumps(res).encode())
+        os._exit(0)
+
+    os.close(w)
+    data = b""
+    while True:
+        buf = os.read(r, 65536)
+        if not buf:
+            break
+        data += buf
+    os.close(r)
+    os.waitpid(pid, 0)
+
+    if not data:
+        return {"error": "no result"}
+    return json.loads(data.decode())
+
+
+# Keep the minimum of each phase, it's the less noisy value
+def bench(filename, entry, repeat):
+    best = None
+    for k in range(repeat):
+        res = run_forked(filename, entry)
+        if "error" in res:
+            return res
+        if best is None:
+            best = res
+            continue
+        for p in PHASES + ["total"]:
+            best[p] = min(best[p], res[p])
+        best["peak_kb"] = min(best["peak_kb"], res["peak_kb"])
+        for p, t in res["passes"].items():
+            best["passes"][p] = min(best["passes"][p], t)
+    return best
+
+
+# Returns the minimum time to run reverse.py with each mode. The results
+# have only the key total.
+def bench_startup(files, repeat):
+    results = {}
+    rev = os.path.join(REVPATH, "reverse.py")
+    for f in files:
+        name = os.path.basename(f)
+        if name.endswith(".bin"):
+            name = name[:-4]
+        for mode, opts in STARTUP_MODES:
+            best = None
+            for k in range(repeat):
+                t = time.perf_counter()
+                subprocess.call([sys.executable, rev, f, "-nc"] + opts,
+                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                t = time.perf_counter() - t
+                best = t if best is None else min(best, t)
+            results["startup_%s_%s" % (name, mode)] = {"total": best}
+    return results
+
+
+def get_targets(files):
+    if not files:
+        files = sorted(glob.glob(REVPATH + "/tests/*.bin") +
+                       glob.glob(REVPATH + "/bench/*.bin"))
+    targets = []
+    for f in files:
+        if ":" in f:
+            filename, entry = f.rsplit(":", 1)
+        else:
+            filename, entry = f, None
+        name = os.path.basename(filename)
+        if name.endswith(".bin"):
+            name = name[:-4]
+        if entry is not None:
+            name += "_" + entry
+        targets.append((name, filename, entry))
+    return targets
+
+
+def print_header():
+    print("%-28s" % "name", end="")
+    for p in PHASES:
+        print("%9s" % p, end="")
+    print("%9s %9s %7s %7s %6s" % ("total", "peak_kb", "blocks", "paths",
+          "loops"))
+
+
+def print_result(name, res):
+    print("%-28s" % name, end="")
+    if "error" in res:
+        print(" ERROR " + res["error"])
+        return
+    for p in PHASES:
+        print("%9.2f" % (res[p] * 1000), end="")
+    print("%9.2f %9d %7d %7d %6d" % (res["total"] * 1000, res["peak_kb"],
+          res["blocks"], res["paths"], res["loops"]), end="")
+    if res["explosion"] is not None:
+        print("  (%s)" % res["explosion"], end="")
+    print()
+    if res["passes"]:
+        print("%-28s" % "", end="")
+        print("  ".join("%s %.2f" % (p, t * 1000)
+                        for p, t in sorted(res["passes"].items())))
+
+
+# A regression is a total time or a peak memory greater than the baseline
+# by more than threshold percent. Times smaller than min_time are ignored,
+# they are too noisy.
+def compare(results, baseline, threshold, min_time):
+    regressions = []
+    for name, res in results.items():
+        if name not in baseline or "error" in res:
+            continue
+        base = baseline[name]
+        if "error" in base:
+            continue
+
+        limit = 1 + threshold / 100
+        if res["total"] > base["total"] * limit and \
+                res["total"] - base["total"] > min_time:
+            regressions.append("%s: total %.2f ms -> %.2f ms" %
+                    (name, base["total"] * 1000, res["total"] * 1000))
+        if "peak_kb" not in res:
+            continue
+        if res["peak_kb"] > base["peak_kb"] * limit:
+            regressions.append("%s: peak %d kb -> %d kb" %
+                    (name, base["peak_kb"], res["peak_kb"]))
+        for k in ["blocks", "paths", "loops"]:
+            if res[k] != base[k]:
+                regressions.append("%s: %s %d -> %d" %
+                        (name, k, base[k], res[k]))
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description=
+        'Benchmark of reverse.py. Times are in milliseconds.')
+    parser.add_argument('files', metavar='FILENAME[:SYMBOL]', nargs='*',
+            help='default tests/*.bin and bench/*.bin, with the symbol main.')
+    parser.add_argument('-r', '--repeat', type=int, default=3, metavar='N',
+            help='default 3, the minimum time of each phase is kept.')
+    parser.add_argument('-o', '--output', metavar='FILENAME',
+            help='Save the results in a json file.')
+    parser.add_argument('-b', '--baseline', metavar='FILENAME',
+            help='Compare with the results saved with -o.')
+    parser.add_argument('--threshold', type=float, default=20, metavar='N',
+            help='default 20, percent of slowdown to report a regression.')
+    parser.add_argument('--mintime', type=float, default=5, metavar='MS',
+            help='default 5, ignore time differences below this value.')
+    parser.add_argument('--startup', action='store_true',
+            help=('Time reverse.py in a new process (-s, --dump and '
+            'decompilation), the files are the binaries to run.'))
+    parser.add_argument('--passes', action='store_true',
+            help='Print the time of each pass over the ast (lib.ast).')
+    args = parser.parse_args()
+
+    global TIME_PASSES
+    TIME_PASSES = args.passes
+
+    results = {}
+    if args.startup:
+        files = args.files or [os.path.join(REVPATH, f)
+                               for f in STARTUP_FILES]
+        results = bench_startup(files, args.repeat)
+        for name, res in sorted(results.items()):
+            print("%-28s %9.2f" % (name, res["total"] * 1000))
+    else:
+        print_header()
+        for name, filename, entry in get_targets(args.files):
+            res = bench(filename, entry, args.repeat)
+            results[name] = res
+            print_result(name, res)
+
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(results, fd, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as fd:
+            baseline = json.load(fd)
+        regressions = compare(results, baseline, args.threshold,
+                args.mintime / 1000)
+        if regressions:
+            print("\nREGRESSIONS :")
+            for r in regressions:
+                print("  " + r)
+            sys.exit(1)
+        print("\nno regressions")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+#include <stdio.h>
+#include <stdlib.h>
+
+int main(int argc, char **argv) {
+    int a, b, c, d, e, f, g, h;
+
+    for (a = 0 ; a < argc ; a++) {
+        if (a == 3)
+            continue;
+        for (b = 0 ; b < a ; b++) {
+            if (b > 5) {
+                for (c = 0 ; c < b ; c++) {
+                    while (c < argc) {
+                        if (c == a)
+                            break;
+                        for (d = 0 ; d < c ; d++) {
+                            if (d & 1) {
+                                for (e = 0 ; e < d ; e++) {
+                                    do {
+                                        for (f = 0 ; f < e ; f++) {
+                                            if (f == b)
+                                                printf("1\n");
+                                            for (g = 0 ; g < f ; g++) {
+                                                if (g == 2)
+                                                    break;
+                                                for (h = 0 ; h < g ; h++) {
+                                                    if (h == d)
+                                                        printf("2\n");
+                                                    else
+                                                        printf("3\n");
+                                                }
+                                            }
+                                        }
+                                        e++;
+                                    } while (e < argc);
+                                }
+                            } else {
+                                printf("4\n");
+                            }
+                        }
+                        c++;
+                    }
+                }
+            }
+        }
+    }
+
+    printf("5\n");
+
+    return 0;
+}
@@ -0,0 +1,91 @@
+#include <stdio.h>
+#include <stdlib.h>
+
+int main(int argc, char **argv) {
+    int i = argc;
+
+    if (i > 0)
+        i += 1;
+    if (i > 1)
+        i += 4;
+    if (i > 2)
+        i += 7;
+    if (i > 3)
+        i += 10;
+    if (i > 4)
+        i += 13;
+    if (i > 5)
+        i += 16;
+    if (i > 6)
+        i += 19;
+    if (i > 7)
+        i += 22;
+    if (i > 8)
+        i += 25;
+    if (i > 9)
+        i += 28;
+    if (i > 10)
+        i += 31;
+    if (i > 11)
+        i += 34;
+    if (i > 12)
+        i += 37;
+    if (i > 13)
+        i += 40;
+    if (i > 14)
+        i += 43;
+    if (i > 15)
+        i += 46;
+    if (i > 16)
+        i += 49;
+    if (i > 17)
+        i += 52;
+    if (i > 18)
+        i += 55;
+    if (i > 19)
+        i += 58;
+    if (i > 20)
+        i += 61;
+    if (i > 21)
+        i += 64;
+    if (i > 22)
+        i += 67;
+    if (i > 23)
+        i += 70;
+    if (i > 24)
+        i += 73;
+    if (i > 25)
+        i += 76;
+    if (i > 26)
+        i += 79;
+    if (i > 27)
+        i += 82;
+    if (i > 28)
+        i += 85;
+    if (i > 29)
+        i += 88;
+    if (i > 30)
+        i += 91;
+    if (i > 31)
+        i += 94;
+    if (i > 32)
+        i += 97;
+    if (i > 33)
+        i += 100;
+    if (i > 34)
+        i += 103;
+    if (i > 35)
+        i += 106;
+    if (i > 36)
+        i += 109;
+    if (i > 37)
+        i += 112;
+    if (i > 38)
+        i += 115;
+    if (i > 39)
+        i += 118;
+
+    printf("%d\n", i);
+
+    return 0;
+}
@@ -0,0 +1,207 @@
+#include <stdio.h>
+#include <stdlib.h>
+
+int main(int argc, char **argv) {
+    int i;
+
+    for (i = 0 ; i < argc ; i++) {
+        switch (argv[i][0]) {
+        case 32:
+            printf("0\n");
+            break;
+        case 33:
+            printf("1\n");
+            break;
+        case 34:
+            printf("2\n");
+            break;
+        case 35:
+            printf("3\n");
+            break;
+        case 36:
+            printf("4\n");
+            break;
+        case 37:
+            printf("5\n");
+            break;
+        case 38:
+            printf("6\n");
+            break;
+        case 39:
+            printf("7\n");
+            break;
+        case 40:
+            printf("8\n");
+            break;
+        case 41:
+            printf("9\n");
+            break;
+        case 42:
+            printf("10\n");
+            break;
+        case 43:
+            printf("11\n");
+            break;
+        case 44:
+            printf("12\n");
+            break;
+        case 45:
+            printf("13\n");
+            break;
+        case 46:
+            printf("14\n");
+            break;
+        case 47:
+            printf("15\n");
+            break;
+        case 48:
+            printf("16\n");
+            break;
+        case 49:
+            printf("17\n");
+            break;
+        case 50:
+            printf("18\n");
+            break;
+        case 51:
+            printf("19\n");
+            break;
+        case 52:
+            printf("20\n");
+            break;
+        case 53:
+            printf("21\n");
+            break;
+        case 54:
+            printf("22\n");
+            break;
+        case 55:
+            printf("23\n");
+            break;
+        case 56:
+            printf("24\n");
+            break;
+        case 57:
+            printf("25\n");
+            break;
+        case 58:
+            printf("26\n");
+            break;
+        case 59:
+            printf("27\n");
+            break;
+        case 60:
+            printf("28\n");
+            break;
+        case 61:
+            printf("29\n");
+            break;
+        case 62:
+            printf("30\n");
+            break;
+        case 63:
+            printf("31\n");
+            break;
+        case 64:
+            printf("32\n");
+            break;
+        case 65:
+            printf("33\n");
+            break;
+        case 66:
+            printf("34\n");
+            break;
+        case 67:
+            printf("35\n");
+            break;
+        case 68:
+            printf("36\n");
+            break;
+        case 69:
+            printf("37\n");
+            break;
+        case 70:
+            printf("38\n");
+            break;
+        case 71:
+            printf("39\n");
+            break;
+        case 72:
+            printf("40\n");
+            break;
+        case 73:
+            printf("41\n");
+            break;
+        case 74:
+            printf("42\n");
+            break;
+        case 75:
+            printf("43\n");
+            break;
+        case 76:
+            printf("44\n");
+            break;
+        case 77:
+            printf("45\n");
+            break;
+        case 78:
+            printf("46\n");
+            break;
+        case 79:
+            printf("47\n");
+            break;
+        case 80:
+            printf("48\n");
+            break;
+        case 81:
+            printf("49\n");
+            break;
+        case 82:
+            printf("50\n");
+            break;
+        case 83:
+            printf("51\n");
+            break;
+        case 84:
+            printf("52\n");
+            break;
+        case 85:
+            printf("53\n");
+            break;
+        case 86:
+            printf("54\n");
+            break;
+        case 87:
+            printf("55\n");
+            break;
+        case 88:
+            printf("56\n");
+            break;
+        case 89:
+            printf("57\n");
+            break;
+        case 90:
+            printf("58\n");
+            break;
+        case 91:
+            printf("59\n");
+            break;
+        case 92:
+            printf("60\n");
+            break;
+        case 93:
+            printf("61\n");
+            break;
+        case 94:
+            printf("62\n");
+            break;
+        case 95:
+            printf("63\n");
+            break;
+        default:
+            printf("default\n");
+        }
+    }
+
+    return 0;
+}
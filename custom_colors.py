@@ -0,0 +1,14 @@
+class COLOR:
+    def __init__(self, val, bold):
+        self.val  = str(val)
+        self.bold = bold
+
+COLOR_SECTION = COLOR(81, False)
+COLOR_KEYWORD = COLOR(161, True)
+COLOR_VAR     = COLOR(208, True)
+COLOR_TYPE    = COLOR(81, False)
+COLOR_COMMENT = COLOR(242, False)
+COLOR_ADDR    = COLOR(242, False)
+COLOR_STRING  = COLOR(144, False)
+COLOR_SYMBOL  = COLOR(144, False)
+COLOR_RETCALL = COLOR(161, False)
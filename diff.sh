@@ -21,8 +21,14 @@ green() {
 }
 
 
+# The environment variables are set by the Makefile for the tests of
+# options (tests/BINARY.TEST.rev) :
+# OPT    : options given to reverse.py
+# STDERR : if not empty, the errors are compared too, after the output
+# REF    : expected output if it's not the .rev file of the test
 __diff() {
     local name=$1
+    local bin=${name%%.*}
     local suffix=""
     local more_opt=""
     local tmp=tmp$$
@@ -32,14 +38,23 @@ __diff() {
         local suffix="_$2"
     fi
 
+    local ref="tests/${name}${suffix}.rev"
+    if [ "$REF" != "" ]; then
+        ref="$REF"
+    fi
 
-    if [ -f "tests/${name}${suffix}.rev" ]; then
-        ./reverse.py "tests/${name}.bin" $more_opt --nosectionsname --nocolor >$tmp 2>/dev/null
+    if [ -f "$ref" ]; then
+        ./reverse.py "tests/${bin}.bin" $more_opt $OPT --nosectionsname --nocolor >$tmp 2>$tmp.err
         if [ $? -eq 0 ]; then
+            if [ "$STDERR" != "" ]; then
+                cat $tmp.err >>$tmp
+            fi
+            rm $tmp.err
+
             if [ $verbose -eq 1 ]; then
-                diff $tmp "tests/${name}${suffix}.rev" 
+                diff $tmp "$ref"
             else
-                diff -q $tmp "tests/${name}${suffix}.rev" >/dev/null
+                diff -q $tmp "$ref" >/dev/null
             fi
 
             if [ $? -eq 0 ]; then
@@ -49,6 +64,7 @@ __diff() {
             fi
             rm $tmp
         else
+            rm -f $tmp $tmp.err
             red "$name$suffix" "[EXCEPTION]\n"
         fi
     else
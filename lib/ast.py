@@ -17,30 +17,38 @@
 # along with this program.    If not, see <http://www.gnu.org/licenses/>.
 #
 
-from lib.utils import invert_cond, is_call, is_uncond_jump, BRANCH_NEXT
-from lib.colors import pick_color, addr_color, color, color_keyword
-from lib.output import (print_block, print_if_cond, print_cmp_jump_commented,
-        print_comment, print_no_end, print_tabbed, print_tabbed_no_end)
-from capstone.x86 import (X86_INS_CMP, X86_INS_MOV, X86_OP_IMM,
-        X86_OP_INVALID, X86_REG_EBP, X86_REG_RBP)
-
-gph = None
-binary = None
-dis = None
-nocomment = False
-
-
-local_vars_idx = {}
-local_vars_size = []
-local_vars_name = []
-vars_counter = 1
+from time import perf_counter
 
-# If an address of a cmp is here, it means that we have fused 
-# with an if, so don't print this instruction.
-cmp_fused = set()
+from lib.utils import invert_cond, is_uncond_jump, BRANCH_NEXT
+from lib.colors import color, color_keyword
+from lib.output import (print_block, print_if_cond, print_cmp_jump_commented,
+        print_comment, print_tabbed, print_tabbed_no_end)
+from capstone.x86 import (X86_INS_CMP, X86_INS_MOV, X86_OP_INVALID,
+        X86_REG_EBP, X86_REG_RBP)
+
+
+# The print methods don't call the print of the children : print_head
+# writes the beginning of the node and returns what follows, a list of
+# strings and of (node, tab, ...) to print. print_node uses a stack, so
+# the depth of the ast is limited only by the memory.
+class Ast_Node:
+    def print(self, ctx, tab=0):
+        print_node(ctx, self, tab)
+
+
+def print_node(ctx, ast, tab):
+    stack = [(ast, tab)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            ctx.out.write(item)
+        elif isinstance(item[0], list):
+            print_block(ctx, item[0], item[1])
+        else:
+            stack.extend(reversed(item[0].print_head(ctx, *item[1:])))
 
 
-class Ast_Branch:
+class Ast_Branch(Ast_Node):
     def __init__(self):
         self.nodes = []
 
@@ -50,50 +58,50 @@ class Ast_Branch:
         else:
             self.nodes.append(node)
 
-    def print(self, tab=0):
-        for n in self.nodes:
-            if isinstance(n, list):
-                print_block(n, tab)
-            else: # ast
-                n.print(tab)
+    def print_head(self, ctx, tab=0):
+        return [(n, tab) for n in self.nodes]
 
 
-class Ast_IfGoto:
+class Ast_IfGoto(Ast_Node):
     def __init__(self, orig_jump, cond_id, addr_jump):
         self.orig_jump = orig_jump
         self.cond_id = cond_id
         self.addr_jump = addr_jump
         self.cmp_inst = None
 
-    def print(self, tab=0):
-        print_cmp_jump_commented(self.cmp_inst, self.orig_jump, tab)
-        print_tabbed_no_end(color_keyword("if "), tab)
-        print_if_cond(self.cmp_inst, self.cond_id)
-        print_no_end(color_keyword("  goto "))
-        print_addr(self.addr_jump)
+    def print_head(self, ctx, tab=0):
+        print_cmp_jump_commented(ctx, self.cmp_inst, self.orig_jump, tab)
+        print_tabbed_no_end(ctx, color_keyword(ctx, "if "), tab)
+        print_if_cond(ctx, self.cmp_inst, self.cond_id)
+        ctx.out.write(color_keyword(ctx, "  goto "))
+        print_addr(ctx, self.addr_jump)
+        return []
 
 
-class Ast_AndIf:
+class Ast_AndIf(Ast_Node):
     def __init__(self, orig_jump, cond_id):
         self.orig_jump = orig_jump
         self.cond_id = cond_id
         self.cmp_inst = None
 
-    def print(self, tab=0):
-        print_cmp_jump_commented(self.cmp_inst, self.orig_jump, tab)
-        print_tabbed_no_end(color_keyword("and ") + color_keyword("if "), tab)
-        print_if_cond(self.cmp_inst, self.cond_id)
-        print()
+    def print_head(self, ctx, tab=0):
+        print_cmp_jump_commented(ctx, self.cmp_inst, self.orig_jump, tab)
+        print_tabbed_no_end(ctx,
+                color_keyword(ctx, "and ") + color_keyword(ctx, "if "),
+                tab)
+        print_if_cond(ctx, self.cmp_inst, self.cond_id)
+        ctx.out.write("\n")
+        return []
 
 
-class Ast_Ifelse:
+class Ast_Ifelse(Ast_Node):
     def __init__(self, jump_inst, br_next_jump, br_next):
         self.jump_inst = jump_inst
         self.br_next = br_next
         self.br_next_jump = br_next_jump
         self.cmp_inst = None
 
-    def print(self, tab=0, print_else_keyword=False):
+    def print_head(self, ctx, tab=0, print_else_keyword=False):
 
         #
         # if cond {
@@ -116,27 +124,27 @@ class Ast_Ifelse:
             br_next, br_next_jump = br_next_jump, br_next
             inv_if = True
             
-        print_cmp_jump_commented(self.cmp_inst, self.jump_inst, tab)
+        print_cmp_jump_commented(ctx, self.cmp_inst, self.jump_inst, tab)
 
         if print_else_keyword:
-            print_tabbed_no_end(color_keyword("else if "), tab)
+            print_tabbed_no_end(ctx, color_keyword(ctx, "else if "), tab)
         else:
-            print_tabbed_no_end(color_keyword("if "), tab)
+            print_tabbed_no_end(ctx, color_keyword(ctx, "if "), tab)
 
         # jump_inst is the condition to go to the else-part
         if inv_if:
-            print_if_cond(self.cmp_inst, self.jump_inst.id)
+            print_if_cond(ctx, self.cmp_inst, self.jump_inst.id)
         else:
-            print_if_cond(self.cmp_inst, invert_cond(self.jump_inst.id))
+            print_if_cond(ctx, self.cmp_inst, invert_cond(self.jump_inst.id))
 
-        print(" {")
+        ctx.out.write(" {\n")
 
         # if-part
-        br_next.print(tab+1)
+        nxt = [(br_next, tab+1)]
 
         # else-part
         if len(br_next_jump.nodes) > 0:
-            print_tabbed_no_end("} ", tab)
+            nxt.append("    " * tab + "} ")
             
             # 
             # if {
@@ -160,38 +168,40 @@ class Ast_Ifelse:
             br = br_next_jump
 
             if len(br.nodes) == 1 and isinstance(br.nodes[0], Ast_Ifelse):
-                print()
-                br.nodes[0].print(tab, True)
-                return
+                nxt.append("\n")
+                nxt.append((br.nodes[0], tab, True))
+                return nxt
 
             if len(br.nodes) == 2 and isinstance(br.nodes[0], list) and \
                   len(br.nodes[0]) == 1 and br.nodes[0][0].id == X86_INS_CMP and \
                   isinstance(br.nodes[1], Ast_Ifelse):
-                print()
-                br.nodes[1].print(tab, True)
-                return
+                nxt.append("\n")
+                nxt.append((br.nodes[1], tab, True))
+                return nxt
 
-            print(color_keyword("else ") + "{")
-            br.print(tab+1)
+            nxt.append(color_keyword(ctx, "else ") + "{\n")
+            nxt.append((br, tab+1))
 
-        print_tabbed("}", tab)
+        nxt.append("    " * tab + "}\n")
+        return nxt
 
 
-class Ast_Jmp:
+class Ast_Jmp(Ast_Node):
     def __init__(self, addr):
         self.addr_jump = addr
 
-    def print(self, tab=0):
-        print_tabbed_no_end("jmp ", tab)
-        print_addr(self.addr_jump)
+    def print_head(self, ctx, tab=0):
+        print_tabbed_no_end(ctx, "jmp ", tab)
+        print_addr(ctx, self.addr_jump)
+        return []
 
 
-def print_addr(addr):
-    c = addr_color.get(addr)
-    print(hex(addr) if c is None else color(hex(addr), c))
+def print_addr(ctx, addr):
+    c = ctx.addr_color.get(addr)
+    ctx.out.write((hex(addr) if c is None else color(ctx, hex(addr), c)) + "\n")
 
 
-class Ast_Loop:
+class Ast_Loop(Ast_Node):
     def __init__(self):
         self.branch = Ast_Branch()
         self.epilog = None
@@ -209,156 +219,327 @@ class Ast_Loop:
     def set_branch(self, b):
         self.branch = b
 
-    def print(self, tab=0):
+    def print_head(self, ctx, tab=0):
         if self.is_infinite:
-            print_tabbed(color_keyword("infiniteloop") + " {", tab)
+            print_tabbed(ctx, color_keyword(ctx, "infiniteloop") + " {", tab)
         else:
-            print_tabbed(color_keyword("loop") + " {", tab)
-        self.branch.print(tab+1)
-        print_tabbed("}", tab)
+            print_tabbed(ctx, color_keyword(ctx, "loop") + " {", tab)
+        nxt = [(self.branch, tab+1), "    " * tab + "}\n"]
         if self.epilog != None:
-            self.epilog.print(tab)
+            nxt.append((self.epilog, tab))
+        return nxt
 
 
-class Ast_Comment:
+class Ast_Comment(Ast_Node):
     def __init__(self, text):
         self.text = text
 
-    def print(self, tab=0):
-        if not nocomment:
-            print_comment("# " + self.text, tab)
+    def print_head(self, ctx, tab=0):
+        if not ctx.nocomment:
+            print_comment(ctx, "# " + self.text, tab)
+        return []
 
 
 # Functions for processing ast
+#
+# The passes over the final ast are fused in one traversal : a pass is a
+# class with methods visit_TYPE(ctx, node) and leave_TYPE(ctx, node),
+# where TYPE is a key of NODE_TYPES. visit is called in pre-order, leave
+# after the children. Only the methods defined are called, so a pass
+# which needs only the blocks doesn't slow down the others. end(ctx) is
+# called after the traversal.
+#
+# In an Ast_Ifelse, br_next (then) is visited before br_next_jump (else),
+# and for an Ast_Loop the branch before the epilog.
+
+NODE_TYPES = {
+    list: "block",
+    Ast_Branch: "branch",
+    Ast_IfGoto: "ifgoto",
+    Ast_AndIf: "andif",
+    Ast_Ifelse: "ifelse",
+    Ast_Loop: "loop",
+    Ast_Jmp: "jmp",
+    Ast_Comment: "comment",
+}
+
+# If True, run_passes saves the time of each pass in ctx.pass_time
+time_passes = False
+
+# Passes run by generate_ast, in this order. See register_pass.
+passes = []
+
+
+# Decorator to add a pass to generate_ast
+def register_pass(cls):
+    passes.append(cls)
+    return cls
+
+
+class Ast_Pass:
+    name = None
+
+    # Returns False to skip the pass (for example colors with --nocolor)
+    def enabled(self, ctx):
+        return True
+
+    def end(self, ctx):
+        pass
+
+
+# Wrap f to add its time to ctx.pass_time[name]
+def timed(ctx, name, f):
+    def wrapper(*args):
+        t = perf_counter()
+        f(*args)
+        ctx.pass_time[name] += perf_counter() - t
+    return wrapper
+
+
+# Run the passes (classes) in a single traversal of the ast. By default
+# the registered passes which are enabled are run.
+def run_passes(ctx, ast, pass_list=None):
+    if pass_list is None:
+        pass_list = [p() for p in passes]
+        pass_list = [p for p in pass_list if p.enabled(ctx)]
+    else:
+        pass_list = [p() for p in pass_list]
+
+    if time_passes:
+        for p in pass_list:
+            ctx.pass_time.setdefault(p.name, 0)
+        names = set(p.name for p in pass_list)
+        t = perf_counter() - sum(ctx.pass_time[n] for n in names)
+
+    # type -> methods to call
+    visit = {}
+    leave = {}
+    for ty, ty_name in NODE_TYPES.items():
+        visit[ty] = []
+        leave[ty] = []
+        for p in pass_list:
+            for m, lst in (("visit_", visit[ty]), ("leave_", leave[ty])):
+                f = getattr(p, m + ty_name, None)
+                if f is not None:
+                    lst.append(timed(ctx, p.name, f) if time_passes else f)
+
+    # The leave is pushed under the children, (node,) is a marker
+    stack = [ast]
+    while stack:
+        n = stack.pop()
+        if type(n) is tuple:
+            for f in leave[type(n[0])]:
+                f(ctx, n[0])
+            continue
+
+        ty = type(n)
+        for f in visit[ty]:
+            f(ctx, n)
+        if leave[ty]:
+            stack.append((n,))
+
+        if ty is Ast_Branch:
+            stack.extend(reversed(n.nodes))
+        elif ty is Ast_Ifelse:
+            stack.append(n.br_next_jump)
+            stack.append(n.br_next)
+        elif ty is Ast_Loop:
+            if n.epilog != None:
+                stack.append(n.epilog)
+            stack.append(n.branch)
+
+    for p in pass_list:
+        if time_passes:
+            timed(ctx, p.name, p.end)(ctx)
+        else:
+            p.end(ctx)
 
-def assign_colors(ast):
-    if isinstance(ast, Ast_Branch):
-        for n in ast.nodes:
-            if isinstance(n, list):
-                if is_uncond_jump(n[0]) and n[0].operands[0].type == X86_OP_IMM:
-                    nxt = gph.link_out[n[0].address][BRANCH_NEXT]
-                    pick_color(nxt)
-            else: # ast
-                assign_colors(n)
-
-    elif isinstance(ast, Ast_IfGoto) or isinstance(ast, Ast_Jmp):
-        pick_color(ast.addr_jump)
-
-    elif isinstance(ast, Ast_Ifelse):
-        assign_colors(ast.br_next_jump)
-        assign_colors(ast.br_next)
-
-    elif isinstance(ast, Ast_Loop):
-        assign_colors(ast.branch)
-        if ast.epilog != None:
-            assign_colors(ast.epilog)
-
-
-def fuse_cmp_if(ast):
-    if isinstance(ast, Ast_Branch):
-        types_ast = (Ast_Ifelse, Ast_IfGoto, Ast_AndIf)
-        for i, n in enumerate(ast.nodes):
-            if isinstance(n, list):
-                if n[-1].id == X86_INS_CMP and i+1 < len(ast.nodes) \
-                            and isinstance(ast.nodes[i+1], types_ast):
-                    ast.nodes[i+1].cmp_inst = n[-1]
-                    cmp_fused.add(n[-1].address)
-            else: # ast
-                fuse_cmp_if(n)
+    if time_passes:
+        # The time of the traversal itself
+        ctx.pass_time["walk"] = ctx.pass_time.get("walk", 0) + \
+            perf_counter() - t - sum(ctx.pass_time[n] for n in names)
 
 
-    elif isinstance(ast, Ast_Ifelse):
-        fuse_cmp_if(ast.br_next)
-        fuse_cmp_if(ast.br_next_jump)
+@register_pass
+class LocalVarsPass(Ast_Pass):
+    name = "local_vars"
 
-    elif isinstance(ast, Ast_Loop):
-        fuse_cmp_if(ast.branch)
-        if ast.epilog != None:
-            fuse_cmp_if(ast.epilog)
+    def visit_block(self, ctx, blk):
+        for inst in blk:
+            self.save_vars(ctx, inst)
 
+    def visit_ifelse(self, ctx, n):
+        if n.cmp_inst != None:
+            self.save_vars(ctx, n.cmp_inst)
 
-def search_local_vars(ast):
-    def inv(n):
-        return n == X86_OP_INVALID
+    visit_ifgoto = visit_ifelse
 
-    def save_vars(i):
-        global vars_counter
+    def save_vars(self, ctx, inst):
         for op in inst.operands:
             mm = op.mem
-            if not inv(mm.base) and mm.disp != 0 \
-                    and inv(mm.segment) and inv(mm.index) \
+            if mm.base != X86_OP_INVALID and mm.disp != 0 \
+                    and mm.segment == X86_OP_INVALID \
+                    and mm.index == X86_OP_INVALID \
                     and (mm.base == X86_REG_RBP or mm.base == X86_REG_EBP):
-                if mm.disp not in local_vars_idx:
-                    local_vars_idx[mm.disp] = len(local_vars_name)
-                    local_vars_name.append("var%d" % vars_counter)
-                    local_vars_size.append(op.size)
-                    vars_counter += 1
-
-
-    if isinstance(ast, Ast_Branch):
-        for i, n in enumerate(ast.nodes):
+                if mm.disp not in ctx.local_vars_idx:
+                    ctx.local_vars_idx[mm.disp] = len(ctx.local_vars_name)
+                    ctx.local_vars_name.append("var%d" % ctx.vars_counter)
+                    ctx.local_vars_size.append(op.size)
+                    ctx.vars_counter += 1
+
+
+# The cmp at the end of a block is printed in the condition of the next
+# if. The branch is visited before its children, so the cmp_inst is set
+# before the other passes visit the if.
+@register_pass
+class FuseCmpIfPass(Ast_Pass):
+    name = "fuse_cmp_if"
+    types_ast = (Ast_Ifelse, Ast_IfGoto, Ast_AndIf)
+
+    def visit_branch(self, ctx, br):
+        for i, n in enumerate(br.nodes):
             if isinstance(n, list):
-                for inst in n:
-                    save_vars(inst)
-            else: # ast
-                search_local_vars(n)
+                if n[-1].id == X86_INS_CMP and i+1 < len(br.nodes) \
+                            and isinstance(br.nodes[i+1], self.types_ast):
+                    br.nodes[i+1].cmp_inst = n[-1]
+                    ctx.cmp_fused.add(n[-1].address)
 
-    elif isinstance(ast, Ast_Ifelse):
-        if ast.cmp_inst != None:
-            save_vars(ast.cmp_inst)
-        search_local_vars(ast.br_next)
-        search_local_vars(ast.br_next_jump)
 
-    elif isinstance(ast, Ast_IfGoto):
-        if ast.cmp_inst != None:
-            save_vars(ast.cmp_inst)
+# The colors are picked with the else-part before the then-part of each
+# if. The addresses are saved in self.addr, and the two parts of an
+# Ast_Ifelse are swapped when it's left.
+@register_pass
+class ColorsPass(Ast_Pass):
+    name = "colors"
 
-    elif isinstance(ast, Ast_Loop):
-        search_local_vars(ast.branch)
-        if ast.epilog != None:
-            search_local_vars(ast.epilog)
+    def __init__(self):
+        self.addr = []
+        # [ifelse, index of the then-part, index of the else-part]
+        self.ifelse = []
+        # (then, else, end) : the parts of each ifelse in self.addr
+        self.ranges = []
+
+    # With --vim the colors are needed for the syntax file
+    def enabled(self, ctx):
+        return not ctx.nocolor or ctx.vim
+
+    def visit_block(self, ctx, blk):
+        if is_uncond_jump(blk[0]) and blk[0].target != -1:
+            self.addr.append(ctx.gph.link_out[blk[0].address][BRANCH_NEXT])
+
+    def visit_ifgoto(self, ctx, n):
+        self.addr.append(n.addr_jump)
+
+    visit_jmp = visit_ifgoto
+
+    def visit_ifelse(self, ctx, n):
+        self.ifelse.append([n, len(self.addr), None])
+
+    def leave_branch(self, ctx, br):
+        if self.ifelse and self.ifelse[-1][0].br_next is br:
+            self.ifelse[-1][2] = len(self.addr)
+
+    def leave_ifelse(self, ctx, n):
+        _, then_idx, else_idx = self.ifelse.pop()
+        if then_idx != len(self.addr):
+            self.ranges.append((then_idx, else_idx, len(self.addr)))
+
+    # The colors are picked with the else-part first : the ranges are
+    # nested, so they are put in a tree and each part is emitted in
+    # this order.
+    def end(self, ctx):
+        # An outer range is left after the inner ones, with the reversed
+        # list (the sort is stable) it's before them.
+        self.ranges.reverse()
+        self.ranges.sort(key=lambda r: r[0])
+        tree = []
+        stack = [(len(self.addr), tree)]
+        for r in self.ranges:
+            while r[0] >= stack[-1][0]:
+                stack.pop()
+            sub = []
+            stack[-1][1].append((r, sub))
+            stack.append((r[2], sub))
+
+        # (start, end, ranges inside)
+        stack = [(0, len(self.addr), tree)]
+        while stack:
+            lo, hi, sub = stack.pop()
+            if not sub:
+                for addr in self.addr[lo:hi]:
+                    ctx.pick_color(addr)
+                continue
+            parts = []
+            for (then_idx, else_idx, end), inner in sub:
+                parts.append((lo, then_idx, []))
+                parts.append((else_idx, end,
+                    [x for x in inner if x[0][0] >= else_idx]))
+                parts.append((then_idx, else_idx,
+                    [x for x in inner if x[0][0] < else_idx]))
+                lo = end
+            parts.append((lo, hi, []))
+            stack.extend(reversed(parts))
+
+
+# Returns at most n instructions before the index k of the block at
+# addr. If it's not enough, the block before in the code (the predecessor
+# which ends at addr) is used.
+def prev_insts(gph, addr, k, n):
+    insts = gph.nodes[addr][max(0, k - n):k]
+    while len(insts) < n:
+        for pred in gph.link_in.get(addr, []):
+            last = gph.nodes[pred][-1]
+            if last.address + last.size == addr:
+                break
+        else:
+            break
+        addr = pred
+        blk = gph.nodes[addr]
+        insts = blk[max(0, len(blk) - n + len(insts)):] + insts
+    return insts
 
 
-def search_canary_plt():
+# The calls to __stack_chk_fail are found with dis.xrefs, only the
+# blocks of the current function are read.
+def search_canary_plt(ctx):
     def inv(n):
         return n == X86_OP_INVALID
 
     fname = "__stack_chk_fail@plt"
-    if fname not in binary.symbols:
+    if fname not in ctx.binary.symbols:
         return
 
-    faddr = binary.symbols[fname]
-
-    k = 0
-    for idx in dis.code_idx:
-        i = dis.code[idx]
-        if is_call(i):
-            op = i.operands[0]
-            if op.type == X86_OP_IMM and op.value.imm == faddr:
-                # Try to get VAR
-                #
-                # rax = VAR # mov rax, qword ptr [rbp - 8]
-                # xor rax, [fs + 40]
-                # je 0x400714
-                # if != {
-                #     call 0x4004f0 <__stack_chk_fail@plt>
-                # }
-                #
-
-                kk = k - 1
-                while kk > 0 and kk > k - 4:
-                    inst = dis.code[dis.code_idx[kk]]
-
-                    if inst.id == X86_INS_MOV:
-                        mm = inst.operands[1].mem
-                        if mm.disp != 0  and inv(mm.segment) and inv(mm.index) and \
-                                mm.base in [X86_REG_RBP, X86_REG_EBP] and \
-                                mm.disp in local_vars_idx:
-                            local_vars_name[local_vars_idx[mm.disp]] += "_canary"
-                            break
-
-                    kk -= 1
+    sites = ctx.dis.xrefs.get(ctx.binary.symbols[fname])
+    if not sites:
+        return
+    sites = set(sites)
 
-                break
+    # The first call in the function : (address, block, index in block)
+    call = None
+    for addr, blk in ctx.gph.nodes.items():
+        for k, i in enumerate(blk):
+            if i.address in sites and (call is None or i.address < call[0]):
+                call = (i.address, addr, k)
 
-        k += 1
+    if call is None:
+        return
+
+    # Try to get VAR
+    #
+    # rax = VAR # mov rax, qword ptr [rbp - 8]
+    # xor rax, [fs + 40]
+    # je 0x400714
+    # if != {
+    #     call 0x4004f0 <__stack_chk_fail@plt>
+    # }
+    #
+
+    for inst in reversed(prev_insts(ctx.gph, call[1], call[2], 3)):
+        if inst.id == X86_INS_MOV:
+            mm = inst.operands[1].mem
+            if mm.disp != 0  and inv(mm.segment) and inv(mm.index) and \
+                    mm.base in [X86_REG_RBP, X86_REG_EBP] and \
+                    mm.disp in ctx.local_vars_idx:
+                idx = ctx.local_vars_idx[mm.disp]
+                ctx.local_vars_name[idx] += "_canary"
+                break
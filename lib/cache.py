@@ -0,0 +1,216 @@
+#
+# Reverse : reverse engineering for x86 binaries
+# Copyright (C) 2015    Joel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.    If not, see <http://www.gnu.org/licenses/>.
+#
+
+# On-disk cache of the analysis of a binary. There is one sqlite
+# database per binary in the directory of --cache, named with the sha256 of the file.
+# It contains the symbols (with the imported symbols of a PE) and the
+# decoded instructions, so the next run doesn't need to load the symbols
+# and to disassemble again.
+#
+# The instructions are json records (see lib/instruction.py) and the
+# addresses of a section are packed in an array, nothing in the file can
+# run code when it's loaded. The database is ignored if VERSION or the
+# version of capstone are different.
+#
+# Only the new instructions and symbols are written, and nothing if the
+# run didn't add anything.
+
+import os
+import json
+import sqlite3
+import hashlib
+from array import array
+from capstone import cs_version
+
+import lib.instruction
+from lib.instruction import inst_from_record, inst_to_record
+from lib.utils import warning
+
+
+# Incremented each time the content of the cache is modified
+VERSION = 2
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE symbols (name TEXT PRIMARY KEY, addr INTEGER);
+CREATE TABLE reverse_symbols (addr INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE reg_names (reg INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE code (addr INTEGER PRIMARY KEY, inst TEXT);
+CREATE TABLE sections (addr INTEGER PRIMARY KEY, idx BLOB);
+"""
+
+
+def get_version():
+    return json.dumps([VERSION, list(cs_version())])
+
+
+class Cache():
+    def __init__(self, cache_dir, data, raw_bits):
+        h = hashlib.sha256(data).hexdigest()
+        self.dir = cache_dir
+        self.path = os.path.join(cache_dir, "%s_%d.db" % (h, raw_bits))
+        self.db = None
+
+        # Symbols of the file, set by set_symbols when they are not
+        # loaded from the cache, so they need to be saved. The user
+        # symbols (--symfile) are not saved.
+        self.symbols = None
+        self.reverse_symbols = None
+
+        # Addresses of the instructions and of the sections already in
+        # the database
+        self.saved_code = set()
+        self.saved_sections = set()
+
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            db = sqlite3.connect(self.path, timeout=10)
+            row = db.execute(
+                "SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if row is not None and row[0] == get_version():
+                self.db = db
+                self.saved_sections = set(r[0] for r in
+                        db.execute("SELECT addr FROM sections"))
+            else:
+                db.close()
+        except sqlite3.Error as e:
+            warning("the cache %s is ignored (%s)" % (self.path, e))
+
+
+    # Returns False if the symbols are not in the cache
+    def load_symbols(self, binary):
+        if self.db is None:
+            return False
+        try:
+            if self.db.execute("SELECT value FROM meta "
+                    "WHERE key = 'symbols'").fetchone() is None:
+                return False
+            binary.symbols.update(
+                    self.db.execute("SELECT name, addr FROM symbols"))
+            binary.reverse_symbols.update(
+                    self.db.execute("SELECT addr, name FROM reverse_symbols"))
+        except sqlite3.Error as e:
+            warning("the cache %s is ignored (%s)" % (self.path, e))
+            binary.symbols.clear()
+            binary.reverse_symbols.clear()
+            return False
+        return True
+
+
+    # The symbols have been loaded from the file, they will be saved
+    def set_symbols(self, binary):
+        self.symbols = dict(binary.symbols)
+        self.reverse_symbols = dict(binary.reverse_symbols)
+
+
+    def load_code(self, dis):
+        if self.db is None:
+            return
+        try:
+            lib.instruction.reg_names.update(
+                    self.db.execute("SELECT reg, name FROM reg_names"))
+            for addr, inst in self.db.execute("SELECT addr, inst FROM code"):
+                dis.code[addr] = inst_from_record(addr, json.loads(inst))
+                self.saved_code.add(addr)
+        except (sqlite3.Error, ValueError, TypeError) as e:
+            warning("the cache %s is ignored (%s)" % (self.path, e))
+            dis.code.clear()
+            self.saved_code.clear()
+            self.saved_sections.clear()
+            self.db.close()
+            self.db = None
+
+
+    # Returns the list of addresses of the instructions of the section if
+    # it was entirely disassembled, otherwise None.
+    def get_section_idx(self, virtual_addr):
+        if virtual_addr not in self.saved_sections:
+            return None
+        row = self.db.execute("SELECT idx FROM sections WHERE addr = ?",
+                (virtual_addr,)).fetchone()
+        idx = array("Q")
+        idx.frombytes(row[0])
+        return idx.tolist()
+
+
+    # The new instructions are added to the cache. sections contains the
+    # code_idx of each section entirely disassembled. The code is never
+    # removed, so the number of instructions tells if there are new ones.
+    def save(self, dis, sections):
+        new_code = len(dis.code) != len(self.saved_code)
+        new_sections = [a for a in sections if a not in self.saved_sections]
+        if not new_code and not new_sections and self.symbols is None:
+            return
+
+        try:
+            if self.db is None:
+                self.__create()
+            self.__write(dis, sections, new_sections)
+        except (OSError, sqlite3.Error) as e:
+            warning("can't write the cache %s (%s)" % (self.path, e))
+
+
+    # A new database is created in a temporary file, so a concurrent
+    # process never reads an incomplete one.
+    def __create(self):
+        os.makedirs(self.dir, exist_ok=True)
+        tmp = "%s.%d" % (self.path, os.getpid())
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        db = sqlite3.connect(tmp)
+        db.executescript(SCHEMA)
+        db.execute("INSERT INTO meta VALUES ('version', ?)", (get_version(),))
+        db.commit()
+        db.close()
+        os.replace(tmp, self.path)
+        self.db = sqlite3.connect(self.path, timeout=10)
+        self.saved_code.clear()
+        self.saved_sections.clear()
+
+
+    def __write(self, dis, sections, new_sections):
+        db = self.db
+        with db:
+            if self.symbols is not None:
+                db.execute("DELETE FROM symbols")
+                db.execute("DELETE FROM reverse_symbols")
+                db.executemany("INSERT INTO symbols VALUES (?, ?)",
+                        self.symbols.items())
+                db.executemany("INSERT INTO reverse_symbols VALUES (?, ?)",
+                        self.reverse_symbols.items())
+                db.execute("INSERT OR REPLACE INTO meta "
+                        "VALUES ('symbols', '1')")
+
+            db.executemany("INSERT OR IGNORE INTO reg_names VALUES (?, ?)",
+                    lib.instruction.reg_names.items())
+
+            new = [a for a in dis.code if a not in self.saved_code]
+            db.executemany("INSERT OR REPLACE INTO code VALUES (?, ?)",
+                    ((a, json.dumps(inst_to_record(dis.code[a])))
+                     for a in new))
+
+            for a in new_sections:
+                db.execute("INSERT OR REPLACE INTO sections VALUES (?, ?)",
+                        (a, array("Q", sections[a]).tobytes()))
+
+        self.symbols = None
+        self.reverse_symbols = None
+        self.saved_code.update(new)
+        self.saved_sections.update(new_sections)
@@ -45,35 +45,16 @@ except:
     from custom_colors import *
 
 
-nocolor = False
-color_counter = 112
+# The colors are disabled with ctx.nocolor (-nc)
 
-addr_color = {}
-
-
-
-def pick_color(addr):
-    global color_counter
-
-    if addr in addr_color:
-        return
-
-    if color_counter == 230:
-        color_counter = 112
-    else:
-        color_counter += 2
-
-    addr_color[addr] = color_counter
-
-
-def color(text, c): # type c == int
-    if nocolor:
+def color(ctx, text, c): # type c == int
+    if ctx.nocolor:
         return text
     return "\x1b[38;5;" + str(c) + "m" + text + "\x1b[0m"
 
 
-def color_class(text, c):
-    if nocolor:
+def color_class(ctx, text, c):
+    if ctx.nocolor:
         return text
     if c.bold:
         return "\x1b[38;5;" + c.val + "m" + bold(text) + "\x1b[0m"
@@ -84,37 +65,37 @@ def bold(text):
     return "\x1b[1m" + text + "\x1b[0m"
 
 
-def color_section(text):
-    return color_class(text, COLOR_SECTION)
+def color_section(ctx, text):
+    return color_class(ctx, text, COLOR_SECTION)
 
 
-def color_keyword(text):
-    return color_class(text, COLOR_KEYWORD)
+def color_keyword(ctx, text):
+    return color_class(ctx, text, COLOR_KEYWORD)
 
 
-def color_var(text):
-    return color_class(text, COLOR_VAR)
+def color_var(ctx, text):
+    return color_class(ctx, text, COLOR_VAR)
 
 
-def color_type(text):
-    return color_class(text, COLOR_TYPE)
+def color_type(ctx, text):
+    return color_class(ctx, text, COLOR_TYPE)
 
 
-def color_comment(text):
-    return color_class(text, COLOR_COMMENT)
+def color_comment(ctx, text):
+    return color_class(ctx, text, COLOR_COMMENT)
 
 
-def color_addr(text):
-    return color_class(text, COLOR_ADDR)
+def color_addr(ctx, text):
+    return color_class(ctx, text, COLOR_ADDR)
 
 
-def color_string(text):
-    return color_class(text, COLOR_STRING)
+def color_string(ctx, text):
+    return color_class(ctx, text, COLOR_STRING)
 
 
-def color_symbol(text):
-    return color_class(text, COLOR_SYMBOL)
+def color_symbol(ctx, text):
+    return color_class(ctx, text, COLOR_SYMBOL)
 
 
-def color_retcall(text):
-    return color_class(text, COLOR_RETCALL)
+def color_retcall(ctx, text):
+    return color_class(ctx, text, COLOR_RETCALL)
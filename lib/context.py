@@ -0,0 +1,71 @@
+#
+# Reverse : reverse engineering for x86 binaries
+# Copyright (C) 2015    Joel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.    If not, see <http://www.gnu.org/licenses/>.
+#
+
+from lib.output import Output
+from lib.fileformat.binary import MAX_STRING_DATA
+
+
+# State of the analysis of one function. It's given to generate_ast,
+# the ast and the printer, so many functions can be analyzed in the same
+# process. options are the options of the output (see reverse.py), so
+# each run has its own.
+class DecompileContext():
+    def __init__(self, dis, gph=None, options={}):
+        self.dis = dis
+        self.binary = dis.binary
+        self.gph = gph
+
+        self.nocolor = options.get("nocolor", False)
+        # The colors are assigned even with nocolor for the vim syntax
+        self.vim = options.get("vim", False)
+        self.nocomment = options.get("nocomment", False)
+        self.nosectionsname = options.get("nosectionsname", False)
+        self.print_andif = options.get("print_andif", True)
+        self.datasize = options.get("datasize", MAX_STRING_DATA)
+
+        # Local variables : disp -> index in local_vars_size/name
+        self.local_vars_idx = {}
+        self.local_vars_size = []
+        self.local_vars_name = []
+        self.vars_counter = 1
+
+        # If an address of a cmp is here, it means that we have fused
+        # with an if, so don't print this instruction.
+        self.cmp_fused = set()
+
+        # Colors of addresses which are referenced by a jump
+        self.addr_color = {}
+        self.color_counter = 112
+
+        # Time of each pass over the ast, see lib.ast.time_passes
+        self.pass_time = {}
+
+        # Text printed, see lib.output.Output
+        self.out = Output()
+
+
+    def pick_color(self, addr):
+        if addr in self.addr_color:
+            return
+
+        if self.color_counter == 230:
+            self.color_counter = 112
+        else:
+            self.color_counter += 2
+
+        self.addr_color[addr] = self.color_counter
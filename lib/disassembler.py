@@ -17,24 +17,49 @@
 #
 
 from capstone import CS_MODE_32, CS_MODE_64, CS_ARCH_X86, Cs
-from capstone.x86 import X86_OP_IMM
 
 from lib.graph import Graph
+import lib.instruction
+from lib.instruction import Instruction, inst_from_record, inst_to_record
 from lib.utils import (die, error, index, is_call, is_cond_jump,
         is_uncond_jump, is_jump, is_ret)
 from lib.fileformat.binary import Binary, ARCH_x86, ARCH_x64, T_BIN_PE
 from lib.output import print_inst, print_symbol
-from lib.colors import pick_color
 
 
-forcejmp = False
+
+# Number of bytes given to capstone at each on-demand decoding. The
+# decoding stops before if a jump or a ret is found.
+LAZY_WINDOW = 128
 
 
 class Disassembler():
-    def __init__(self, filename, raw_bits=0):
+    def __init__(self, filename, raw_bits=0, cache_dir=None):
         self.code = {}
         self.code_idx = []
-        self.binary = Binary(filename, raw_bits)
+        self.binary = Binary(filename, raw_bits, cache_dir)
+        self.lazy = False
+        self.md = None
+        self.__data = None
+        self.__virtual_addr = 0
+
+        # Sections entirely disassembled : virtual_addr -> list of
+        # addresses, saved in the cache.
+        self.__full_sections = {}
+
+        # Calls of the decoded instructions : target -> list of addresses
+        # of the calls. It's updated when an instruction is decoded.
+        self.xrefs = {}
+
+        # If it's a list, the addresses of the decoded instructions are
+        # appended. With -j the workers send them to the main process, so
+        # they are saved in the cache (see pop_new_code and add_code).
+        self.new_code = None
+
+        if self.binary.cache is not None:
+            self.binary.cache.load_code(self)
+            for i in self.code.values():
+                self.__add_xref(i)
 
         arch = self.binary.get_arch()
         if arch == ARCH_x86:
@@ -45,25 +70,136 @@ class Disassembler():
             die("only x86 and x64 are supported")
 
 
-    def disasm(self, addr):
+    # If lazy is True, nothing is disassembled here : instructions are
+    # decoded on demand by get_inst, so only the reachable code of the
+    # function is disassembled.
+    #
+    # It can be called for each function, the section is loaded only if
+    # it's not the current one.
+    def disasm(self, addr, lazy=False):
         (data, virtual_addr, flags) = self.binary.get_section(addr)
 
         if not flags["exec"]:
             die("the address 0x%x is not in an executable section" % addr)
 
+        # Imported symbols of a PE are resolved by searching all calls
+        # in the code, so we need the whole section.
+        if self.binary.get_type() == T_BIN_PE:
+            lazy = False
+
+        # If the section was disassembled lazily, it's done again if the
+        # whole section is now needed.
+        if self.md is not None and virtual_addr == self.__virtual_addr and \
+                (lazy or virtual_addr in self.__full_sections):
+            return
+
         mode = CS_MODE_64 if self.bits == 64 else CS_MODE_32
-        md = Cs(CS_ARCH_X86, mode)
-        md.detail = True
+        self.md = Cs(CS_ARCH_X86, mode)
+        self.md.detail = True
+
+        self.lazy = lazy
+        self.__data = data
+        self.__virtual_addr = virtual_addr
 
-        for i in md.disasm(data, virtual_addr):
-            self.code[i.address] = i
-            self.code_idx.append(i.address)
+        if lazy:
+            return
+
+        if virtual_addr not in self.__full_sections:
+            self.__full_sections[virtual_addr] = self.__disasm_section(data,
+                    virtual_addr)
+
+        # code_idx may contain instructions decoded on demand if the
+        # disassembler was lazy before.
+        self.code_idx = []
+        for idx in self.__full_sections.values():
+            self.code_idx += idx
+
+
+    # Disassemble the whole section, returns the list of addresses
+    def __disasm_section(self, data, virtual_addr):
+        # The symbols in the cache already contain the imported symbols.
+        cache = self.binary.cache
+        if cache is not None:
+            idx = cache.get_section_idx(virtual_addr)
+            if idx is not None:
+                return idx
+
+        # The instructions already decoded (by get_inst or loaded from the
+        # cache) are kept, their xrefs are already added.
+        idx = []
+        for i in self.md.disasm(bytes(data), virtual_addr):
+            if i.address not in self.code:
+                self.__add_inst(Instruction(i))
+            idx.append(i.address)
 
         # Now load imported symbols for PE. This cannot be done before,
         # because we need the code for a better resolution.
         if self.binary.get_type() == T_BIN_PE:
             self.binary.load_import_symbols(self.code)
 
+        return idx
+
+
+    def __add_inst(self, inst):
+        self.code[inst.address] = inst
+        self.__add_xref(inst)
+        if self.new_code is not None:
+            self.new_code.append(inst.address)
+
+
+    # Returns the instructions decoded since the last call, as records
+    # for add_code. The register names are global to the process, so
+    # they are given too.
+    def pop_new_code(self):
+        records = [(a, inst_to_record(self.code[a])) for a in self.new_code]
+        self.new_code = []
+        return records, dict(lib.instruction.reg_names)
+
+
+    # Add the instructions decoded by another process
+    def add_code(self, code):
+        records, reg_names = code
+        lib.instruction.reg_names.update(reg_names)
+        for addr, rec in records:
+            if addr not in self.code:
+                self.__add_inst(inst_from_record(addr, rec))
+
+
+    def __add_xref(self, inst):
+        if is_call(inst) and inst.target != -1:
+            if inst.target in self.xrefs:
+                self.xrefs[inst.target].append(inst.address)
+            else:
+                self.xrefs[inst.target] = [inst.address]
+
+
+    # Add the decoded instructions to the cache (if enabled)
+    def save_cache(self):
+        if self.binary.cache is not None:
+            self.binary.cache.save(self, self.__full_sections)
+
+
+    # Returns the instruction at addr, raise KeyError if there is no
+    # instruction at this address.
+    def get_inst(self, addr):
+        if addr in self.code or not self.lazy:
+            return self.code[addr]
+
+        off = addr - self.__virtual_addr
+        if off < 0 or off >= len(self.__data):
+            raise KeyError(addr)
+
+        window = bytes(self.__data[off:off + LAZY_WINDOW])
+        for i in self.md.disasm(window, addr):
+            if i.address in self.code:
+                break
+            inst = Instruction(i)
+            self.__add_inst(inst)
+            if is_jump(inst) or is_ret(inst):
+                break
+
+        return self.code[addr]
+
 
     def get_addr_from_string(self, opt_addr, raw=False):
         if opt_addr is None:
@@ -91,41 +227,68 @@ class Disassembler():
         return a
 
 
-    def dump(self, addr, lines):
-        i_init = index(self.code_idx, addr)
-        end = min(len(self.code_idx), i_init + lines)
+    def __get_lines(self, addr, lines):
+        if not self.lazy:
+            i_init = index(self.code_idx, addr)
+            end = min(len(self.code_idx), i_init + lines)
+            return [self.code[self.code_idx[i]] for i in range(i_init, end)]
+
+        insts = []
+        try:
+            while len(insts) < lines:
+                inst = self.get_inst(addr)
+                insts.append(inst)
+                addr = inst.address + inst.size
+        except KeyError:
+            pass
+        return insts
+
+
+    # The output is written to fd (default sys.stdout)
+    def dump(self, ctx, addr, lines, fd=None):
+        insts = self.__get_lines(addr, lines)
 
         # set jumps color
-        i = i_init
-        while i < end:
-            inst = self.code[self.code_idx[i]]
-            if is_jump(inst) and inst.operands[0].type == X86_OP_IMM:
-                pick_color(inst.operands[0].value.imm)
-            i += 1
-
-        i = i_init
-        while i < end:
-            inst = self.code[self.code_idx[i]]
+        for inst in insts:
+            if is_jump(inst) and inst.target != -1:
+                ctx.pick_color(inst.target)
+
+        for inst in insts:
             if inst.address in self.binary.reverse_symbols:
-                print_symbol(inst.address)
-                print()
-            print_inst(inst, 0)
-            i += 1
+                print_symbol(ctx, inst.address)
+                ctx.out.write("\n")
+            print_inst(ctx, inst, 0)
+
+        ctx.out.flush(fd)
 
 
-    def print_calls(self):
+    def print_calls(self, ctx):
         for i in self.code_idx:
             inst = self.code[i]
             if is_call(inst):
-                print_inst(inst)
+                print_inst(ctx, inst)
+        ctx.out.flush()
 
 
-    def get_graph(self, addr):
-        graph = self.__extract_func(addr)
-        graph.init()
+    # options are the options of the analysis (see reverse.py) : forcejmp
+    # and the limits of the Budget.
+    def get_graph(self, addr, options={}):
+        graph = self.extract_func(addr, options.get("forcejmp", False))
+        graph.init(options)
         return graph
 
 
+    # Returns the address of all symbols in an executable section, sorted.
+    # Entries of the plt are not functions of the binary.
+    def get_functions(self):
+        functions = []
+        for addr, name in self.binary.reverse_symbols.items():
+            if not name.endswith("@plt") and self.binary.is_exec(addr):
+                functions.append(addr)
+        functions.sort()
+        return functions
+
+
     def print_symbols(self):
         for addr in self.binary.reverse_symbols:
             sy = self.binary.reverse_symbols[addr]
@@ -148,17 +311,17 @@ class Disassembler():
 
 
     # Generate a flow graph of the given function (addr)
-    def __extract_func(self, addr):
-        curr = self.code[addr]
+    # If forcejmp is False, it stops on a "jmp reg"
+    def extract_func(self, addr, forcejmp=False):
+        curr = self.get_inst(addr)
         gph = Graph(self, addr)
         rest = []
 
         while 1:
             if not gph.exists(curr):
                 if is_uncond_jump(curr) and len(curr.operands) > 0:
-                    if curr.operands[0].type == X86_OP_IMM:
-                        addr = curr.operands[0].value.imm
-                        nxt = self.code[addr]
+                    if curr.target != -1:
+                        nxt = self.get_inst(curr.target)
                         gph.set_next(curr, nxt)
                         rest.append(nxt.address)
                     else:
@@ -167,9 +330,9 @@ class Disassembler():
                         gph.add_node(curr)
 
                 elif is_cond_jump(curr) and len(curr.operands) > 0:
-                    if curr.operands[0].type == X86_OP_IMM:
-                        nxt_jump = self.code[curr.operands[0].value.imm]
-                        direct_nxt = self.code[curr.address + curr.size]
+                    if curr.target != -1:
+                        nxt_jump = self.get_inst(curr.target)
+                        direct_nxt = self.get_inst(curr.address + curr.size)
                         gph.set_cond_next(curr, nxt_jump, direct_nxt)
                         rest.append(nxt_jump.address)
                         rest.append(direct_nxt.address)
@@ -183,7 +346,7 @@ class Disassembler():
 
                 else:
                     try:
-                        nxt = self.code[curr.address + curr.size]
+                        nxt = self.get_inst(curr.address + curr.size)
                         gph.set_next(curr, nxt)
                         rest.append(nxt.address)
                     except:
@@ -191,7 +354,7 @@ class Disassembler():
                         pass
 
             try:
-                curr = self.code[rest.pop()]
+                curr = self.get_inst(rest.pop())
             except IndexError:
                 break
 
@@ -16,14 +16,20 @@
 # along with this program.    If not, see <http://www.gnu.org/licenses/>.
 #
 
-import lib.fileformat.elf
-import lib.fileformat.pe
-import lib.fileformat.raw
-from lib.utils import die
+import mmap
+import importlib
+from collections import OrderedDict
 
+import lib.cache
+from lib.utils import die, get_char
 
+
+# Default of the option --datasize
 MAX_STRING_DATA = 30
 
+# Maximum number of strings kept by Binary.get_string
+STRING_CACHE_SIZE = 4096
+
 ARCH_x64 = 0
 ARCH_x86 = 1
 ARCH_INVALID = -1
@@ -34,38 +40,130 @@ T_BIN_PE = 1
 T_BIN_UNK = 2
 
 
+# Supported file formats : (magic, name, type, module, class). The first
+# format where the file starts with magic is loaded, the module is
+# imported only at this moment. A new format can be appended here.
+FORMATS = [
+    (b"\x7fELF", "ELF", T_BIN_ELF, "lib.fileformat.elf", "ELF"),
+    (b"MZ", "PE", T_BIN_PE, "lib.fileformat.pe", "PE"),
+]
+
+
 class Binary(object):
-    def __init__(self, filename, raw_bits=0):
+    # cache_dir is the option --cache, None if the cache is disabled
+    def __init__(self, filename, raw_bits=0, cache_dir=None):
         self.__binary = None
         self.reverse_symbols = {}
         self.symbols = {}
 
+        # LRU cache of get_string : (addr, max_data) -> string
+        self.__strings = OrderedDict()
+
+        # The file is mapped once : pyelftools and pefile read it from
+        # file_map, and sections are slices of data (no copy).
+        with open(filename, "rb") as fd:
+            try:
+                self.file_map = mmap.mmap(fd.fileno(), 0,
+                                          access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty file
+                self.file_map = b""
+        self.data = memoryview(self.file_map)
+
+        if cache_dir is not None:
+            self.cache = lib.cache.Cache(cache_dir, self.data, raw_bits)
+        else:
+            self.cache = None
+
+        # The backend is imported only when it's needed, pyelftools and
+        # pefile are slow to import.
         if raw_bits != 0:
-            self.__binary = lib.fileformat.raw.Raw(filename, raw_bits)
+            from lib.fileformat.raw import Raw
+            self.__binary = Raw(self, raw_bits)
+            self.__type = T_BIN_UNK
         else:
+            self.__load_format()
+
+            if self.cache is None or not self.cache.load_symbols(self):
+                self.__binary.load_static_sym()
+                self.__binary.load_dyn_sym()
+                if self.cache is not None:
+                    self.cache.set_symbols(self)
+
+
+    def __load_format(self):
+        for magic, name, ty, module, cls_name in FORMATS:
+            if bytes(self.data[:len(magic)]) != magic:
+                continue
+            cls = getattr(importlib.import_module(module), cls_name)
             try:
-                self.__binary = lib.fileformat.elf.ELF(self, filename)
-            except Exception:
-                try:
-                    self.__binary = lib.fileformat.pe.PE(self, filename)
-                except Exception:
-                    die("the file is not PE or ELF binary")
+                self.__binary = cls(self)
+            except Exception as e:
+                die("can't load the %s file (%s)" % (name, e))
+            self.__type = ty
+            return
 
-            self.__binary.load_static_sym()
-            self.__binary.load_dyn_sym()
-            self.__binary.load_data_sections()
+        die("unknown file format, supported formats are %s. "
+            "Try --raw32 or --raw64." % ", ".join(f[1] for f in FORMATS))
 
 
     def is_data(self, addr):
-        return self.__binary.is_data(addr)
+        return self.__binary.data_sections.find(addr) is not None
 
 
-    def get_section(self, addr):
-        return self.__binary.get_section(addr)
+    def is_exec(self, addr):
+        s = self.__binary.sections.find(addr)
+        return s is not None and s.is_exec
 
 
-    def get_string(self, addr):
-        return self.__binary.get_string(addr)
+    def get_section(self, addr):
+        s = self.__binary.sections.find(addr)
+        if s is None:
+            die("the address 0x%x is not in a section" % addr)
+        flags = {
+            "exec": s.is_exec
+        }
+        return (s.data, s.start, flags)
+
+
+    # Returns at most max_data chars of the string at addr
+    def get_string(self, addr, max_data=MAX_STRING_DATA):
+        key = (addr, max_data)
+        txt = self.__strings.get(key)
+        if txt is not None:
+            self.__strings.move_to_end(key)
+            return txt
+
+        txt = self.__read_string(addr, max_data)
+        self.__strings[key] = txt
+        if len(self.__strings) > STRING_CACHE_SIZE:
+            self.__strings.popitem(last=False)
+        return txt
+
+
+    def __read_string(self, addr, max_data):
+        s = self.__binary.data_sections.find(addr)
+        if s is None:
+            return ""
+
+        data = s.data
+        off = addr - s.start
+        size = s.end - s.start
+        txt = ['"']
+
+        i = 0
+        while i < max_data and off < size:
+            c = data[off]
+            if c == 0:
+                break
+            txt.append(get_char(c))
+            off += 1
+            i += 1
+
+        if c != 0 and off != size:
+            txt.append("...")
+
+        return ''.join(txt) + '"'
 
 
     def get_arch(self):
@@ -76,15 +174,14 @@ class Binary(object):
     # and a bool if it's a data section.
     # (name, is_data)
     def is_address(self, imm):
-        return self.__binary.is_address(imm)
+        s = self.__binary.sections.find(imm)
+        if s is None:
+            return None, False
+        return s.name, s.is_data
 
 
     def get_type(self):
-        if isinstance(self.__binary, lib.fileformat.elf.ELF):
-            return T_BIN_ELF
-        if isinstance(self.__binary, lib.fileformat.pe.PE):
-            return T_BIN_PE
-        return T_BIN_UNK
+        return self.__type
 
 
     def get_entry_point(self):
@@ -94,3 +191,5 @@ class Binary(object):
     # Only for PE !
     def load_import_symbols(self, code):
         self.__binary.load_import_symbols(code)
+        if self.cache is not None:
+            self.cache.set_symbols(self)
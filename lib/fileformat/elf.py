@@ -20,7 +20,7 @@ from elftools.elf.elffile import ELFFile
 from elftools.elf.constants import SH_FLAGS
 
 import lib.fileformat.binary
-import lib.utils
+from lib.fileformat.sections import Section, SectionsIndex
 
 
 # SHF_WRITE=0x1
@@ -39,17 +39,30 @@ import lib.utils
 
 
 class ELF:
-    def __init__(self, classbinary, filename):
-        fd = open(filename, "rb")
-        self.elf = ELFFile(fd)
+    def __init__(self, classbinary):
+        self.elf = ELFFile(classbinary.file_map)
         self.classbinary = classbinary
-        self.__data_sections = []
-        self.__data_sections_data = []
         self.arch_lookup = {
           "x86": lib.fileformat.binary.ARCH_x86,
           "x64": lib.fileformat.binary.ARCH_x64
         }
 
+        # Sections which are not loaded in memory (sh_addr == 0) are
+        # ignored.
+        sections = []
+        for s in self.elf.iter_sections():
+            start = s.header.sh_addr
+            if start == 0:
+                continue
+            off = s.header.sh_offset
+            size = s.header.sh_size
+            sections.append(Section(s.name.decode(), start, start + size,
+                self.__section_is_exec(s), self.__section_is_data(s),
+                classbinary.data[off:off + size]))
+
+        self.sections = SectionsIndex(sections)
+        self.data_sections = SectionsIndex([s for s in sections if s.is_data])
+
 
     def load_static_sym(self):
         symtab = self.elf.get_section_by_name(b".symtab")
@@ -85,85 +98,15 @@ class ELF:
             k += 1
 
 
-    def load_data_sections(self):
-        for s in self.elf.iter_sections():
-            if self.__section_is_data(s):
-                self.__data_sections.append(s)
-                self.__data_sections_data.append(s.data())
-
-
-    def __get_data_section_idx(self, addr):
-        for i, s in enumerate(self.__data_sections):
-            start = s.header.sh_addr
-            end = start + s.header.sh_size
-            if start <= addr < end:
-                return i
-        return -1
-
-
     def __section_is_data(self, s):
         mask = SH_FLAGS.SHF_WRITE | SH_FLAGS.SHF_ALLOC
         return s.header.sh_flags & mask and not self.__section_is_exec(s)
 
 
-    def is_address(self, imm):
-        for s in self.elf.iter_sections():
-            start = s.header.sh_addr
-            if start == 0:
-                continue
-            end = start + s.header.sh_size
-            if  start <= imm < end:
-                return s.name.decode(), self.__section_is_data(s)
-        return None, False
-
-
-    def __find_section(self, addr):
-        for s in self.elf.iter_sections():
-            start = s.header.sh_addr
-            end = start + s.header.sh_size
-            if  start <= addr < end:
-                return s
-        return None
-
-
-    def get_section(self, addr):
-        s = self.__find_section(addr)
-        flags = {
-            "exec": self.__section_is_exec(s)
-        }
-        return (s.data(), s.header.sh_addr, flags)
-
-
     def __section_is_exec(self, s):
         return s.header.sh_flags & SH_FLAGS.SHF_EXECINSTR
 
 
-    def get_string(self, addr):
-        i = self.__get_data_section_idx(addr)
-        if i == -1:
-            return ""
-
-        s = self.__data_sections[i]
-        data = self.__data_sections_data[i]
-        off = addr - s.header.sh_addr
-        txt = ['"']
-
-        i = 0
-        while i < lib.fileformat.binary.MAX_STRING_DATA and \
-              off < s.header.sh_size:
-            c = data[off]
-            if c == 0:
-                break
-            txt.append(lib.utils.get_char(c))
-            off += 1
-            i += 1
-
-        if c != 0 and off != s.header.sh_size:
-            txt.append("...")
-
-        return ''.join(txt) + '"'
-
-
     def get_arch(self):
         return self.arch_lookup.get(self.elf.get_machine_arch(), \
             lib.fileformat.binary.ARCH_INVALID)
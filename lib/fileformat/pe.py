@@ -21,16 +21,36 @@ import pefile
 import lib.utils
 import lib.fileformat.binary
 from lib.fileformat.pefile2 import PE2, SymbolEntry
+from lib.fileformat.sections import Section, SectionsIndex
 from ctypes import sizeof
-from capstone.x86 import X86_OP_INVALID, X86_OP_IMM, X86_OP_MEM
+from capstone.x86 import X86_OP_INVALID, X86_OP_MEM
 
 
 class PE:
-    def __init__(self, classbinary, filename):
+    def __init__(self, classbinary):
         self.classbinary = classbinary
-        self.pe = PE2(filename, fast_load=True)
-        self.__data_sections = []
-        self.__data_sections_data = []
+        self.pe = PE2(data=classbinary.file_map, fast_load=True)
+
+        base = self.pe.OPTIONAL_HEADER.ImageBase
+        sections = []
+        data_sections = []
+
+        for s in self.pe.sections:
+            name = s.Name.decode().rstrip(' \0')
+            start = base + s.VirtualAddress
+            is_exec = self.__section_is_exec(s)
+            is_data = self.__section_is_data(s)
+            data = self.__section_data(s)
+            sections.append(Section(name, start, base + self.__section_end(s),
+                is_exec, is_data, data))
+
+            # The data is searched only in the raw size
+            if is_data:
+                data_sections.append(Section(name, start,
+                    start + s.SizeOfRawData, is_exec, is_data, data))
+
+        self.sections = SectionsIndex(sections)
+        self.data_sections = SectionsIndex(data_sections)
 
 
     def load_static_sym(self):
@@ -111,11 +131,10 @@ class PE:
 
         for ad in code:
             inst = code[ad]
-            if not lib.utils.is_call(inst) or \
-                inst.operands[0].type != X86_OP_IMM:
+            if not lib.utils.is_call(inst) or inst.target == -1:
                 continue
 
-            goto = inst.operands[0].value.imm
+            goto = inst.target
             nxt = code[goto]
 
             if not lib.utils.is_uncond_jump(nxt) or \
@@ -131,88 +150,38 @@ class PE:
                 self.classbinary.symbols[name] = goto
 
 
-    def load_data_sections(self):
-        for s in self.pe.sections:
-            if self.__section_is_data(s):
-                self.__data_sections.append(s)
-                self.__data_sections_data.append(s.get_data())
-
-
     def __section_is_data(self, s):
              # INITIALIZED_DATA | MEM_READ   | MEM_WRITE
         mask = 0x00000040       | 0x40000000 | 0x80000000
         return s.Characteristics & mask and not self.__section_is_exec(s)
 
 
-    def is_data(self, addr):
-        base = self.pe.OPTIONAL_HEADER.ImageBase
-        for s in self.__data_sections:
-            start = base + s.VirtualAddress
-            end = start + s.SizeOfRawData
-            if start <= addr < end:
-                return True
-        return False
+    # Same as pefile.SectionStructure.get_data, but it returns a slice
+    # of the mapped file.
+    def __section_data(self, s):
+        off = s.get_PointerToRawData_adj()
+        end = min(off + s.SizeOfRawData, s.PointerToRawData + s.SizeOfRawData)
+        return self.classbinary.data[off:end]
 
 
-    def __get_data_section(self, addr):
-        base = self.pe.OPTIONAL_HEADER.ImageBase
-        for i, s in enumerate(self.__data_sections):
-            start = base + s.VirtualAddress
-            end = start + s.SizeOfRawData
-            if start <= addr < end:
-                return i
-        return -1
-
-
-    def get_section(self, addr):
-        base = self.pe.OPTIONAL_HEADER.ImageBase
-        s = self.pe.get_section_by_rva(addr - base)
-        flags = {
-            "exec": self.__section_is_exec(s)
-        }
-        return (s.get_data(), base + s.VirtualAddress, flags)
-
-
-    def is_address(self, imm):
-        base = self.pe.OPTIONAL_HEADER.ImageBase
-        if imm > base:
-            s = self.pe.get_section_by_rva(imm - base)
-            if s is not None:
-                return s.Name.decode().rstrip(' \0'), self.__section_is_data(s)
-        return None, False
+    # Same range as pefile.SectionStructure.contains_rva (relative to
+    # ImageBase) : the virtual size is used if it's greater than the raw
+    # size, and the section is cut at the beginning of the next one.
+    def __section_end(self, s):
+        size = max(s.SizeOfRawData, s.Misc_VirtualSize)
+        if len(self.pe.__data__) - s.PointerToRawData < s.SizeOfRawData:
+            size = s.Misc_VirtualSize
+        end = s.VirtualAddress + size
+        for nxt in self.pe.sections:
+            if s.VirtualAddress < nxt.VirtualAddress < end:
+                end = nxt.VirtualAddress
+        return end
 
 
     def __section_is_exec(self, s):
         return s.Characteristics & 0x20000000
 
 
-    def get_string(self, addr):
-        i = self.__get_data_section(addr)
-        if i == -1:
-            return ""
-
-        s = self.__data_sections[i]
-        data = self.__data_sections_data[i]
-        base = self.pe.OPTIONAL_HEADER.ImageBase
-        off = addr - s.VirtualAddress - base
-        txt = ['"']
-
-        i = 0
-        while i < lib.fileformat.binary.MAX_STRING_DATA and \
-              off < s.SizeOfRawData:
-            c = data[off]
-            if c == 0:
-                break
-            txt.append(lib.utils.get_char(c))
-            off += 1
-            i += 1
-
-        if c != 0 and off != s.SizeOfRawData:
-            txt.append("...")
-
-        return ''.join(txt) + '"'
-
-
     def get_arch(self):
         arch = self.pe.OPTIONAL_HEADER.Magic
         if arch == pefile.OPTIONAL_HEADER_MAGIC_PE:
@@ -18,17 +18,24 @@
 
 
 import lib.fileformat.binary
+from lib.fileformat.sections import Section, SectionsIndex
 
 
 class Raw:
-    def __init__(self, filename, bits):
-        self.raw = open(filename, "rb").read()
+    def __init__(self, classbinary, bits):
+        self.raw = classbinary.data
         self.bits = bits
         self.arch_lookup = {
           32: lib.fileformat.binary.ARCH_x86,
           64: lib.fileformat.binary.ARCH_x64
         }
 
+        # The whole file is an executable section at the address 0. It
+        # has no name, so immediates are not printed as addresses.
+        self.sections = SectionsIndex([Section(None, 0, len(self.raw), True,
+            False, self.raw)])
+        self.data_sections = SectionsIndex([])
+
 
     def load_static_sym(self):
         return
@@ -38,25 +45,6 @@ class Raw:
         return
 
 
-    def load_data_sections(self):
-        return
-
-
-    def is_address(self, imm):
-        return None, False
-
-
-    def get_section(self, addr):
-        flags = {
-            "exec": True
-        }
-        return (self.raw, 0, flags)
-
-
-    def get_string(self, addr):
-        return ""
-
-
     def get_arch(self):
         return self.arch_lookup[self.bits]
 
@@ -0,0 +1,65 @@
+#
+# Reverse : reverse engineering for x86 binaries
+# Copyright (C) 2015    Joel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.    If not, see <http://www.gnu.org/licenses/>.
+#
+
+from bisect import bisect_right
+
+
+# A section is the range [start, end). data is the content in the file,
+# it's a memoryview on Binary.data.
+class Section():
+    __slots__ = ("name", "start", "end", "is_exec", "is_data", "data")
+
+    def __init__(self, name, start, end, is_exec, is_data, data):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.is_exec = bool(is_exec)
+        self.is_data = bool(is_data)
+        self.data = data
+
+
+# Index of sections built once when the binary is loaded. The addresses
+# are split in intervals where the owner section doesn't change, so a
+# section is found with a bisect. If some sections overlap, the first in
+# the list is returned, like a linear search in the order of the file.
+class SectionsIndex():
+    def __init__(self, sections):
+        self.sections = sections
+        self.__bounds = sorted({s.start for s in sections} |
+                               {s.end for s in sections})
+        self.__owner = []
+
+        for addr in self.__bounds[:-1]:
+            owner = None
+            for s in sections:
+                if s.start <= addr < s.end:
+                    owner = s
+                    break
+            self.__owner.append(owner)
+
+
+    # Returns the section which contains addr or None
+    def find(self, addr):
+        k = bisect_right(self.__bounds, addr) - 1
+        if k < 0 or k >= len(self.__owner):
+            return None
+        return self.__owner[k]
+
+
+    def __iter__(self):
+        return iter(self.sections)
@@ -17,21 +17,35 @@
 # along with this program.    If not, see <http://www.gnu.org/licenses/>.
 #
 
-import lib.colors
 from lib.ast import (Ast_Branch, Ast_Comment, Ast_Jmp, Ast_Loop, Ast_IfGoto,
-        Ast_Ifelse, Ast_AndIf, assign_colors, search_local_vars, fuse_cmp_if,
-        search_canary_plt)
+        Ast_Ifelse, Ast_AndIf, run_passes, search_canary_plt)
 from lib.utils import (is_cond_jump, is_uncond_jump, invert_cond,
-        BRANCH_NEXT, BRANCH_NEXT_JUMP, die)
+        BRANCH_NEXT, BRANCH_NEXT_JUMP, die, warning)
 from lib.paths import get_loop_start
+from lib.graph import ExplosionError
+
+
+# get_ast_branch, get_ast_loop and get_ast_ifelse are generators : to
+# call one of them, a function yields the generator and receives the
+# result. They are executed here with a stack instead of recursive
+# calls, so the depth of nested blocks is limited only by the memory.
+def run_generator(gen):
+    stack = [gen]
+    ret = None
+    while stack:
+        try:
+            sub = stack[-1].send(ret)
+        except StopIteration as e:
+            stack.pop()
+            ret = e.value
+        else:
+            stack.append(sub)
+            ret = None
+    return ret
 
 
-gph = None
-print_andif = True
-
-
-def get_ast_ifgoto(paths, curr_loop_idx, inst):
-    nxt = gph.link_out[inst.address]
+def get_ast_ifgoto(ctx, paths, curr_loop_idx, inst):
+    nxt = ctx.gph.link_out[inst.address]
 
     c1 = paths.loop_contains(curr_loop_idx, nxt[BRANCH_NEXT])
     c2 = paths.loop_contains(curr_loop_idx, nxt[BRANCH_NEXT_JUMP])
@@ -74,11 +88,13 @@ def get_ast_ifgoto(paths, curr_loop_idx, inst):
     return Ast_IfGoto(inst, cond_id, br)
 
 
-def get_ast_branch(paths, curr_loop_idx=[], last_else=-1, endif=-1):
+def get_ast_branch(ctx, paths, curr_loop_idx=[], last_else=-1, endif=-1):
     ast = Ast_Branch()
     if_printed = False
 
     while 1:
+        ctx.gph.budget.check()
+
         if paths.rm_empty_paths():
             break
 
@@ -90,14 +106,14 @@ def get_ast_branch(paths, curr_loop_idx=[], last_else=-1, endif=-1):
         # until == -1 if there is no common point at the begining
         last = -1
         while last != until:
-            blk = gph.nodes[paths.first()]
+            blk = ctx.gph.nodes[paths.first()]
             inst = blk[0] # first inst
 
             # Here if we have conditional jump, it's not a ifelse,
             # it's a condition for a loop. It will be replaced by a
             # goto. ifgoto are skipped by head_last_common.
             if is_cond_jump(inst):
-                ast.add(get_ast_ifgoto(paths, curr_loop_idx, inst))
+                ast.add(get_ast_ifgoto(ctx, paths, curr_loop_idx, inst))
             else:
                 ast.add(blk)
 
@@ -107,19 +123,21 @@ def get_ast_branch(paths, curr_loop_idx=[], last_else=-1, endif=-1):
             break
 
         if force_stop_addr != 0:
-            blk = gph.nodes[paths.first()]
+            blk = ctx.gph.nodes[paths.first()]
             ast.add(blk)
             if not is_uncond_jump(blk[0]):
-                ast.add(Ast_Jmp(gph.link_out[blk[0].address][BRANCH_NEXT]))
+                ast.add(Ast_Jmp(ctx.gph.link_out[blk[0].address][BRANCH_NEXT]))
             break
 
         if is_loop:
             # last_else == -1
             # -> we can't go to a same else inside a loop
-            a, endpoint = get_ast_loop(paths, curr_loop_idx, -1, endif)
+            a, endpoint = yield get_ast_loop(ctx, paths, curr_loop_idx, -1,
+                    endif)
             ast.add(a)
         elif is_ifelse:
-            a, endpoint = get_ast_ifelse(paths, curr_loop_idx, last_else, if_printed, endif)
+            a, endpoint = yield get_ast_ifelse(ctx, paths, curr_loop_idx,
+                    last_else, if_printed, endif)
             if_printed = isinstance(a, Ast_Ifelse)
             ast.add(a)
         else:
@@ -135,25 +153,25 @@ def get_ast_branch(paths, curr_loop_idx=[], last_else=-1, endif=-1):
 
 # TODO move in class Paths
 # Assume that the beginning of paths is the beginning of a loop
-def paths_is_infinite(paths):
+def paths_is_infinite(ctx, paths):
     for p in paths.paths:
         for addr in p:
-            inst = gph.nodes[addr][0]
+            inst = ctx.gph.nodes[addr][0]
             if is_cond_jump(inst):
-                nxt = gph.link_out[addr]
+                nxt = ctx.gph.link_out[addr]
                 if nxt[BRANCH_NEXT] not in paths or \
                    nxt[BRANCH_NEXT_JUMP] not in paths: \
                     return False
     return True
 
 
-def get_ast_loop(paths, last_loop, last_else, endif):
+def get_ast_loop(ctx, paths, last_loop, last_else, endif):
     ast = Ast_Loop()
     curr_loop_idx = paths.get_loops_idx()
-    first_blk = gph.nodes[get_loop_start(curr_loop_idx)]
+    first_blk = ctx.gph.nodes[get_loop_start(ctx.gph, curr_loop_idx)]
 
     if is_cond_jump(first_blk[0]):
-        ast.add(get_ast_ifgoto(paths, curr_loop_idx, first_blk[0]))
+        ast.add(get_ast_ifgoto(ctx, paths, curr_loop_idx, first_blk[0]))
     else:
         ast.add(first_blk)
 
@@ -162,10 +180,11 @@ def get_ast_loop(paths, last_loop, last_else, endif):
     # Checking if endloop == [] to determine if it's an 
     # infinite loop is not sufficient
     # tests/nestedloop2
-    ast.set_infinite(paths_is_infinite(loop_paths))
+    ast.set_infinite(paths_is_infinite(ctx, loop_paths))
 
     paths.pop()
-    ast.add(get_ast_branch(loop_paths, curr_loop_idx, last_else))
+    ast.add((yield get_ast_branch(ctx, loop_paths, curr_loop_idx,
+            last_else)))
 
     if not endloop:
         return ast, -1
@@ -175,7 +194,7 @@ def get_ast_loop(paths, last_loop, last_else, endif):
         i = 1
         for el in endloop[:-1]:
             epilog.add(Ast_Comment("endloop " + str(i)))
-            epilog.add(get_ast_branch(el, last_loop, last_else))
+            epilog.add((yield get_ast_branch(ctx, el, last_loop, last_else)))
             i += 1
         epilog.add(Ast_Comment("endloop " + str(i)))
 
@@ -184,11 +203,11 @@ def get_ast_loop(paths, last_loop, last_else, endif):
     return ast, endloop[-1].first()
 
 
-def get_ast_ifelse(paths, curr_loop_idx, last_else, is_prev_andif, endif):
+def get_ast_ifelse(ctx, paths, curr_loop_idx, last_else, is_prev_andif, endif):
     addr = paths.pop()
     paths.rm_empty_paths()
-    jump_inst = gph.nodes[addr][0]
-    nxt = gph.link_out[addr]
+    jump_inst = ctx.gph.nodes[addr][0]
+    nxt = ctx.gph.link_out[addr]
 
     if_addr = nxt[BRANCH_NEXT]
     else_addr = nxt[BRANCH_NEXT_JUMP] if len(nxt) == 2 else -1
@@ -265,7 +284,7 @@ def get_ast_ifelse(paths, curr_loop_idx, last_else, is_prev_andif, endif):
     # }
     #
 
-    if print_andif:
+    if ctx.print_andif:
         if last_else != -1 and not is_prev_andif:
             # TODO not sure about endpoint == -1
             # tests/or4
@@ -275,32 +294,69 @@ def get_ast_ifelse(paths, curr_loop_idx, last_else, is_prev_andif, endif):
             # if else_addr == -1 or else_addr == last_else:
             if else_addr != -1 and (else_addr == last_else or else_addr == endif) or \
                     last_else == endif and endif == endpoint and endpoint != -1:
-                endpoint = gph.link_out[addr][BRANCH_NEXT]
+                endpoint = ctx.gph.link_out[addr][BRANCH_NEXT]
                 return (Ast_AndIf(jump_inst, invert_cond(jump_inst.id)), endpoint)
 
     if else_addr == -1:
         else_addr = last_else
 
-    a1 = get_ast_branch(split[BRANCH_NEXT_JUMP], curr_loop_idx, -1, endpoint)
-    a2 = get_ast_branch(split[BRANCH_NEXT], curr_loop_idx, else_addr, endpoint)
+    a1 = yield get_ast_branch(ctx, split[BRANCH_NEXT_JUMP], curr_loop_idx,
+            -1, endpoint)
+    a2 = yield get_ast_branch(ctx, split[BRANCH_NEXT], curr_loop_idx,
+            else_addr, endpoint)
 
     return (Ast_Ifelse(jump_inst, a1, a2), endpoint)
 
 
 
-def generate_ast(graph):
-    global gph
-    gph = graph
+# Used when the function can't be structured : each block is printed
+# in the order of addresses, and jumps are replaced by gotos.
+def get_ast_blocks(ctx):
+    ast = Ast_Branch()
+    addrs = sorted(ctx.gph.nodes)
+
+    for k, addr in enumerate(addrs):
+        blk = ctx.gph.nodes[addr]
+        inst = blk[0]
+        nxt_addr = addrs[k+1] if k+1 < len(addrs) else -1
 
-    ast = get_ast_branch(gph.paths)
+        if addr not in ctx.gph.link_out:
+            ast.add(blk)
+            continue
 
-    # Process ast
+        nxt = ctx.gph.link_out[addr]
 
-    search_local_vars(ast)
-    fuse_cmp_if(ast)
-    search_canary_plt() 
+        if is_cond_jump(inst):
+            ast.add(Ast_IfGoto(inst, inst.id, nxt[BRANCH_NEXT_JUMP]))
+        else:
+            ast.add(blk)
+            if is_uncond_jump(blk[-1]):
+                continue
+
+        if nxt[BRANCH_NEXT] != nxt_addr:
+            ast.add(Ast_Jmp(nxt[BRANCH_NEXT]))
+
+    return ast
+
+
+# ctx is a DecompileContext, the ast is built from ctx.gph
+def generate_ast(ctx):
+    reason = ctx.gph.explosion
+
+    if reason is None:
+        try:
+            ast = run_generator(get_ast_branch(ctx, ctx.gph.paths))
+        except ExplosionError as e:
+            reason = str(e)
+
+    if reason is not None:
+        warning("0x%x: %s, the function is printed without structure" %
+                (ctx.gph.entry_point_addr, reason))
+        ast = get_ast_blocks(ctx)
+
+    # Process ast
 
-    if not lib.colors.nocolor:
-        assign_colors(ast)
+    run_passes(ctx, ast)
+    search_canary_plt(ctx)
 
     return ast
@@ -19,8 +19,69 @@
 
 import os
 import os.path
+import time
+import resource
 from lib.utils import BRANCH_NEXT, BRANCH_NEXT_JUMP, index, is_cond_jump, is_jump
-from lib.paths import Paths
+from lib.paths import Path, Paths
+
+
+# Default of the option --maxpaths
+MAX_PATHS = 100000
+
+# The resident memory is read at most once in RSS_INTERVAL seconds,
+# reading /proc at each step of the exploration costs more than the step.
+RSS_INTERVAL = 0.05
+
+
+class ExplosionError(Exception):
+    pass
+
+
+# Current resident memory of the process in KB. Without /proc, only the
+# peak (ru_maxrss) is available.
+def get_rss():
+    try:
+        with open("/proc/self/statm") as fd:
+            return int(fd.read().split()[1]) * resource.getpagesize() // 1024
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+# Limits for the analysis of one function, given by the options
+# maxpaths, maxtime (seconds) and maxmem (MB), 0 means no limit. When one
+# of them is exceeded, the function is printed as a list of blocks with
+# gotos (see generate_ast).
+#
+# The memory is the growth of the resident memory since the creation of
+# the budget, so the memory used by a previous function (--all, -j,
+# --server) is not counted.
+class Budget():
+    def __init__(self, options={}):
+        self.max_paths = options.get("maxpaths", MAX_PATHS)
+        self.max_time = options.get("maxtime", 0)
+        self.max_memory = options.get("maxmem", 0)
+        self.start = time.time()
+        self.start_rss = get_rss() if self.max_memory else 0
+        self.last_rss = self.start
+
+
+    def check_paths(self, nb_paths):
+        if self.max_paths and nb_paths > self.max_paths:
+            raise ExplosionError("more than %d paths" % self.max_paths)
+
+
+    def check(self):
+        if not self.max_time and not self.max_memory:
+            return
+        now = time.time()
+        if self.max_time and now - self.start > self.max_time:
+            raise ExplosionError("analysis takes more than %d seconds" %
+                    self.max_time)
+        if self.max_memory and now - self.last_rss >= RSS_INTERVAL:
+            self.last_rss = now
+            if get_rss() - self.start_rss > self.max_memory * 1024:
+                raise ExplosionError("memory usage is over %d MB" %
+                        self.max_memory)
 
 
 class Graph:
@@ -44,6 +105,11 @@ class Graph:
         self.nested_loops_idx = {}
         self.direct_nested_idx = {}
         self.paths = None
+        self.budget = None
+
+        # If the budget is exceeded, the reason is saved here and the
+        # function can't be structured.
+        self.explosion = None
 
         # If a loop is "marked" it means that there is an other equivalent
         # loop, and this must not be interpreted during the process. Generally
@@ -84,9 +150,15 @@ class Graph:
         return inst.address in self.nodes
 
 
-    def init(self):
+    # options are the limits of the Budget
+    def init(self, options={}):
+        self.budget = Budget(options)
         self.__simplify()
-        self.__explore(self.entry_point_addr)
+        try:
+            self.__explore(self.entry_point_addr)
+        except ExplosionError as e:
+            self.explosion = str(e)
+            return
         self.__search_equivalent_loops()
         self.__compute_nested()
 
@@ -113,25 +185,22 @@ class Graph:
             if pred not in self.link_out or len(self.link_out[pred]) != 1:
                 continue
 
-            if curr in self.link_out:
-                self.link_out[pred] = self.link_out[curr]
-            else:
-                del self.link_out[pred]
-
             self.nodes[pred] += self.nodes[curr]
-
-            if curr in self.link_out:
-                del self.link_out[curr]
-
             del self.link_in[curr]
             del self.nodes[curr]
 
-            # replace all addr wich refers to curr
-            for k, lst_i in self.link_in.items():
-                try:
-                    lst_i[lst_i.index(curr)] = pred
-                except ValueError:
-                    pass
+            if curr not in self.link_out:
+                del self.link_out[pred]
+                continue
+
+            # curr is not a jump, so it has only one successor : it's
+            # the only list in link_in which refers to curr.
+            nxt = self.link_out[curr]
+            self.link_out[pred] = nxt
+            del self.link_out[curr]
+
+            lst_i = self.link_in[nxt[0]]
+            lst_i[lst_i.index(curr)] = pred
 
 
     # Check d3/index.html !
@@ -181,12 +250,12 @@ class Graph:
         def save_step(k, addr, create):
             nonlocal new_paths, moved
 
-            try:
-                # This path is looping if index doesn't fail
-
-                idx_node = self.paths.paths[k].index(addr)
+            p = self.paths.paths[k]
+            idx_node = p.search(addr)
 
-                l = self.paths.paths[k][idx_node:]
+            # This path is looping if addr is already in the path
+            if idx_node != -1:
+                l = p.tolist(idx_node)
                 l_idx = index(self.loops, l)
 
                 if l_idx == -1:
@@ -197,22 +266,23 @@ class Graph:
                 if create:
                     idx_new_path = len(self.paths.paths) + len(new_paths)
                     self.paths.looping[idx_new_path] = l_idx
-                    new_paths.append(list(self.paths.paths[k]))
+                    new_paths.append(p.copy())
                 else:
                     self.paths.looping[k] = l_idx
 
-            except ValueError:
+            else:
                 moved = True
                 if create:
-                    new_paths.append(self.paths.paths[k] + [addr])
-                else:
-                    self.paths.paths[k].append(addr)
+                    p = p.copy()
+                    new_paths.append(p)
+                p.append(addr)
 
         moved = True
-        self.paths = Paths()
-        self.paths.paths = [[start]]
+        self.paths = Paths(self)
+        self.paths.paths = [Path([start])]
 
         while moved:
+            self.budget.check()
             new_paths = []
             moved = False
 
@@ -230,6 +300,8 @@ class Graph:
                 nxt = self.link_out[last]
                 if is_cond_jump(inst):
                     save_step(k, nxt[BRANCH_NEXT_JUMP], True)
+                    self.budget.check_paths(
+                            len(self.paths.paths) + len(new_paths))
                 save_step(k, nxt[BRANCH_NEXT], False)
 
             self.paths.paths += new_paths
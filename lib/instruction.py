@@ -0,0 +1,150 @@
+#!/bin/python3
+#
+# Reverse : reverse engineering for x86 binaries
+# Copyright (C) 2015    Joel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.    If not, see <http://www.gnu.org/licenses/>.
+#
+
+from capstone import CS_GRP_CALL, CS_GRP_JUMP, CS_GRP_RET
+from capstone.x86 import (X86_INS_JMP, X86_OP_FP, X86_OP_IMM, X86_OP_MEM,
+        X86_OP_REG)
+
+
+# Values for Instruction.flags
+FLAG_JUMP = 1
+FLAG_COND_JUMP = 2
+FLAG_CALL = 4
+FLAG_RET = 8
+
+
+# Register names are the same for all instructions, they are saved
+# when the instructions are converted.
+reg_names = {}
+
+
+def save_reg_name(i, reg):
+    if reg != 0 and reg not in reg_names:
+        reg_names[reg] = i.reg_name(reg)
+
+
+class Mem:
+    __slots__ = ("segment", "base", "index", "scale", "disp")
+
+    def __init__(self, segment=0, base=0, index=0, scale=1, disp=0):
+        self.segment = segment
+        self.base = base
+        self.index = index
+        self.scale = scale
+        self.disp = disp
+
+
+# Used for all operands which are not a memory access. All registers
+# are set to X86_REG_INVALID.
+NO_MEM = Mem()
+
+
+class Operand:
+    __slots__ = ("type", "size", "imm", "reg", "fp", "mem")
+
+    def __init__(self, i, op):
+        self.type = op.type
+        self.size = op.size
+        self.imm = 0
+        self.reg = 0
+        self.fp = 0.0
+        self.mem = NO_MEM
+
+        if op.type == X86_OP_IMM:
+            self.imm = op.imm
+        elif op.type == X86_OP_REG:
+            self.reg = op.reg
+            save_reg_name(i, op.reg)
+        elif op.type == X86_OP_FP:
+            self.fp = op.fp
+        elif op.type == X86_OP_MEM:
+            mm = op.mem
+            self.mem = Mem(mm.segment, mm.base, mm.index, mm.scale, mm.disp)
+            save_reg_name(i, mm.segment)
+            save_reg_name(i, mm.base)
+            save_reg_name(i, mm.index)
+
+
+# Compact copy of a capstone instruction. The capstone details are read
+# only once here, then all accesses are simple attributes.
+class Instruction:
+    __slots__ = ("address", "size", "id", "mnemonic", "op_str", "operands",
+                 "flags", "target")
+
+    def __init__(self, i):
+        self.address = i.address
+        self.size = i.size
+        self.id = i.id
+        self.mnemonic = i.mnemonic
+        self.op_str = i.op_str
+        self.operands = [Operand(i, op) for op in i.operands]
+
+        groups = i.groups
+        self.flags = 0
+        if CS_GRP_JUMP in groups:
+            self.flags |= FLAG_JUMP
+            if i.id != X86_INS_JMP:
+                self.flags |= FLAG_COND_JUMP
+        if CS_GRP_CALL in groups:
+            self.flags |= FLAG_CALL
+        if CS_GRP_RET in groups:
+            self.flags |= FLAG_RET
+
+        # Address of a jump or a call, -1 if it's not an immediate
+        self.target = -1
+        if self.flags & (FLAG_JUMP | FLAG_CALL) and self.operands and \
+                self.operands[0].type == X86_OP_IMM:
+            self.target = self.operands[0].imm
+
+    def reg_name(self, reg):
+        if reg == 0:
+            return "(invalid)"
+        return reg_names[reg]
+
+
+# An instruction is saved in the cache (see lib/cache.py) as a list of
+# numbers and strings, without the address. It can be written in json,
+# so loading the cache can't run code.
+def inst_to_record(i):
+    ops = []
+    for op in i.operands:
+        mm = op.mem
+        ops.append([op.type, op.size, op.imm, op.reg, op.fp,
+                    mm.segment, mm.base, mm.index, mm.scale, mm.disp])
+    return [i.size, i.id, i.mnemonic, i.op_str, i.flags, i.target, ops]
+
+
+def inst_from_record(addr, rec):
+    i = Instruction.__new__(Instruction)
+    i.address = addr
+    i.size, i.id, i.mnemonic, i.op_str, i.flags, i.target, ops = rec
+    i.operands = []
+    for (ty, size, imm, reg, fp, segment, base, index, scale, disp) in ops:
+        op = Operand.__new__(Operand)
+        op.type = ty
+        op.size = size
+        op.imm = imm
+        op.reg = reg
+        op.fp = fp
+        if ty == X86_OP_MEM:
+            op.mem = Mem(segment, base, index, scale, disp)
+        else:
+            op.mem = NO_MEM
+        i.operands.append(op)
+    return i
@@ -0,0 +1,211 @@
+#
+# Reverse : reverse engineering for x86 binaries
+# Copyright (C) 2015    Joel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.    If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Output of the ast in json (option --json). Each function is written on
+# one line, so with --all a function is written as soon as it's analyzed
+# and the file can be read line by line (see load_json).
+#
+# Nodes have a key "type" :
+#   function : entry, name, vars [{name, size}], ast
+#   branch   : nodes (list of nodes)
+#   block    : insts (list of instructions)
+#   ifgoto   : cmp, jump, cond, target
+#   andif    : cmp, jump, cond
+#   ifelse   : cmp, jump, cond, then (branch), else (branch)
+#   loop     : infinite, branch, epilog (node or null)
+#   jmp      : target
+#   comment  : text
+#
+# cond is the condition to enter in the if (or to go to target), for
+# example "==" or "<". cmp is null if the jump is not preceded by a cmp.
+
+import sys
+import json
+
+from lib.ast import (Ast_Branch, Ast_Comment, Ast_Jmp, Ast_Loop, Ast_IfGoto,
+        Ast_Ifelse, Ast_AndIf)
+from lib.instruction import reg_names
+from lib.output import get_var_name, var_name_exists
+from lib.utils import inst_symbol, invert_cond
+from capstone.x86 import (X86_OP_FP, X86_OP_IMM, X86_OP_INVALID, X86_OP_MEM,
+        X86_OP_REG, X86_REG_EBP, X86_REG_RBP)
+
+
+def reg_name(reg):
+    return reg_names[reg] if reg != 0 else None
+
+
+def operand_to_json(ctx, i, num_op):
+    op = i.operands[num_op]
+    if op.type == X86_OP_IMM:
+        o = {"type": "imm", "imm": op.imm, "size": op.size}
+        sec_name, is_data = ctx.binary.is_address(op.imm)
+        if sec_name is not None:
+            o["section"] = sec_name
+            if is_data:
+                o["string"] = ctx.binary.get_string(op.imm,
+                        ctx.datasize)
+            sym = ctx.binary.reverse_symbols.get(op.imm)
+            if sym is not None:
+                o["symbol"] = sym
+        return o
+
+    if op.type == X86_OP_REG:
+        return {"type": "reg", "reg": reg_name(op.reg), "size": op.size}
+
+    if op.type == X86_OP_FP:
+        return {"type": "fp", "fp": op.fp, "size": op.size}
+
+    if op.type == X86_OP_MEM:
+        mm = op.mem
+        o = {
+            "type": "mem",
+            "size": op.size,
+            "segment": reg_name(mm.segment),
+            "base": reg_name(mm.base),
+            "index": reg_name(mm.index),
+            "scale": mm.scale,
+            "disp": mm.disp,
+        }
+        # Same conditions as print_operand
+        if mm.base in (X86_REG_RBP, X86_REG_EBP) and mm.disp != 0 and \
+                mm.segment == X86_OP_INVALID and \
+                mm.index == X86_OP_INVALID and \
+                var_name_exists(ctx, i, num_op):
+            o["var"] = get_var_name(ctx, i, num_op)
+        return o
+
+    return {"type": "invalid"}
+
+
+def inst_to_json(ctx, i):
+    if i is None:
+        return None
+    o = {
+        "address": i.address,
+        "size": i.size,
+        "id": i.id,
+        "mnemonic": i.mnemonic,
+        "op_str": i.op_str,
+        "operands": [operand_to_json(ctx, i, n)
+                for n in range(len(i.operands))],
+    }
+    # This cmp is printed with the next if
+    if i.address in ctx.cmp_fused:
+        o["fused"] = True
+    return o
+
+
+def cond(cmp_inst, jump_id):
+    return inst_symbol(jump_id, cmp_inst is not None)
+
+
+def dumps(obj):
+    return json.dumps(obj, separators=(",", ":"))
+
+
+# Returns the beginning of the node and what follows : a list of
+# strings and of nodes to write.
+def node_head(ctx, ast):
+    if isinstance(ast, list):
+        return dumps({
+            "type": "block",
+            "insts": [inst_to_json(ctx, i) for i in ast],
+        }), []
+
+    if isinstance(ast, Ast_Branch):
+        nxt = []
+        for n in ast.nodes:
+            if nxt:
+                nxt.append(",")
+            nxt.append(n)
+        nxt.append("]}")
+        return '{"type":"branch","nodes":[', nxt
+
+    if isinstance(ast, Ast_IfGoto):
+        return dumps({
+            "type": "ifgoto",
+            "cmp": inst_to_json(ctx, ast.cmp_inst),
+            "jump": inst_to_json(ctx, ast.orig_jump),
+            "cond": cond(ast.cmp_inst, ast.cond_id),
+            "target": ast.addr_jump,
+        }), []
+
+    if isinstance(ast, Ast_AndIf):
+        return dumps({
+            "type": "andif",
+            "cmp": inst_to_json(ctx, ast.cmp_inst),
+            "jump": inst_to_json(ctx, ast.orig_jump),
+            "cond": cond(ast.cmp_inst, ast.cond_id),
+        }), []
+
+    if isinstance(ast, Ast_Ifelse):
+        # jump_inst is the condition to go to the else-part
+        head = '{"type":"ifelse","cmp":%s,"jump":%s,"cond":%s,"then":' % (
+            dumps(inst_to_json(ctx, ast.cmp_inst)),
+            dumps(inst_to_json(ctx, ast.jump_inst)),
+            dumps(cond(ast.cmp_inst, invert_cond(ast.jump_inst.id))))
+        return head, [ast.br_next, ',"else":', ast.br_next_jump, "}"]
+
+    if isinstance(ast, Ast_Loop):
+        head = '{"type":"loop","infinite":%s,"branch":' % \
+            dumps(ast.is_infinite)
+        epilog = "null" if ast.epilog is None else ast.epilog
+        return head, [ast.branch, ',"epilog":', epilog, "}"]
+
+    if isinstance(ast, Ast_Jmp):
+        return dumps({"type": "jmp", "target": ast.addr_jump}), []
+
+    if isinstance(ast, Ast_Comment):
+        return dumps({"type": "comment", "text": ast.text}), []
+
+    raise TypeError("unknown ast node %s" % type(ast).__name__)
+
+
+# Same arguments as lib.output.print_ast. The function is written on one
+# line to fd (default sys.stdout). The ast is written with a stack, like
+# lib.ast.print_node, so there is no limit of depth.
+def print_json(ctx, entry, ast, fd=None):
+    if fd is None:
+        fd = sys.stdout
+
+    out = []
+    out.append('{"type":"function","entry":%d,"name":%s,"vars":%s,"ast":' % (
+        entry,
+        dumps(ctx.binary.reverse_symbols.get(entry, hex(entry))),
+        dumps([{"name": name, "size": size} for name, size in
+               zip(ctx.local_vars_name, ctx.local_vars_size)])))
+
+    stack = ["}\n", ast]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            out.append(item)
+        else:
+            head, nxt = node_head(ctx, item)
+            out.append(head)
+            stack.extend(reversed(nxt))
+
+    fd.write("".join(out))
+
+
+# Returns an iterator on the functions written by print_json
+def load_json(fd):
+    for line in fd:
+        if line.strip():
+            yield json.loads(line)
@@ -17,11 +17,11 @@
 # along with this program.    If not, see <http://www.gnu.org/licenses/>.
 #
 
+import sys
 
-import lib.ast
-from lib.colors import (addr_color, color, color_addr, color_comment,
-        color_keyword, color_retcall, color_string, color_type, color_var,
-        color_section, color_symbol)
+from lib.colors import (color, color_addr, color_comment, color_keyword,
+        color_retcall, color_string, color_type, color_var, color_section,
+        color_symbol)
 from lib.utils import (get_char, inst_symbol, is_call, is_jump, is_ret, 
         is_uncond_jump)
 from capstone.x86 import (X86_INS_ADD, X86_INS_AND, X86_INS_CMP, X86_INS_DEC,
@@ -32,61 +32,73 @@ from capstone.x86 import (X86_INS_ADD, X86_INS_AND, X86_INS_CMP, X86_INS_DEC,
         X86_INS_OR)
 
 
-binary = None
-nocomment = False
-nosectionsname = False
+# Buffer of the text of a function (or of a dump). The print functions
+# only append strings here, the text is written to the file in one call
+# by flush, so the output can be a terminal, a pipe, a file (--vim) or
+# a string.
+class Output():
+    def __init__(self):
+        self.__buf = []
+        self.write = self.__buf.append
 
 
-def print_block(blk, tab):
-    for i in blk:
-        print_inst(i, tab)
+    def getvalue(self):
+        return "".join(self.__buf)
+
+
+    def flush(self, fd=None):
+        if fd is None:
+            fd = sys.stdout
+        fd.write(self.getvalue())
+        self.__buf.clear()
 
 
-def print_tabbed(string, tab):
-    print("    " * tab, end="")
-    print(string)
+def print_block(ctx, blk, tab):
+    for i in blk:
+        print_inst(ctx, i, tab)
 
 
-def print_tabbed_no_end(string, tab):
-    print("    " * tab, end="")
-    print(string, end="")
+def print_tabbed(ctx, string, tab):
+    ctx.out.write("    " * tab + string + "\n")
 
 
-def print_no_end(text):
-    print(text, end="")
+def print_tabbed_no_end(ctx, string, tab):
+    ctx.out.write("    " * tab + string)
 
 
-def print_symbol(addr):
-    print_no_end(color_symbol("<" + binary.reverse_symbols[addr] + ">"))
+def print_symbol(ctx, addr):
+    ctx.out.write(color_symbol(ctx, "<" + ctx.binary.reverse_symbols[addr] + ">"))
 
 
 # Return True if the operand is a variable (because the output is
 # modified, we reprint the original instruction later)
-def print_operand(i, num_op, hexa=False):
+def print_operand(ctx, i, num_op, hexa=False):
     def inv(n):
         return n == X86_OP_INVALID
 
+    o = ctx.out
     op = i.operands[num_op]
 
     if op.type == X86_OP_IMM:
-        imm = op.value.imm
-        sec_name, is_data = binary.is_address(imm)
+        imm = op.imm
+        sec_name, is_data = ctx.binary.is_address(imm)
 
         if sec_name is not None:
-            print_no_end(hex(imm))
-            if not nosectionsname:
-                print_no_end(" (" + color_section(sec_name) + ")")
+            o.write(hex(imm))
+            if not ctx.nosectionsname:
+                o.write(" (" + color_section(ctx, sec_name) + ")")
             if is_data: 
-                print_no_end(" " + color_string(binary.get_string(imm)))
-            if imm in binary.reverse_symbols:
-                print_no_end(" ")
-                print_symbol(imm)
+                o.write(" " + color_string(ctx,
+                        ctx.binary.get_string(imm, ctx.datasize)))
+            if imm in ctx.binary.reverse_symbols:
+                o.write(" ")
+                print_symbol(ctx, imm)
         elif op.size == 1:
-            print_no_end(color_string("'%s'" % get_char(imm)))
+            o.write(color_string(ctx, "'%s'" % get_char(imm)))
         elif hexa:
-            print_no_end(hex(imm))
+            o.write(hex(imm))
         else:
-            print_no_end(str(imm))
+            o.write(str(imm))
             # returns True because capstone print immediate in hexa
             # it will be printed in a comment, sometimes it better
             # to have the value in hexa
@@ -95,11 +107,11 @@ def print_operand(i, num_op, hexa=False):
         return False
 
     elif op.type == X86_OP_REG:
-        print_no_end(i.reg_name(op.value.reg))
+        o.write(i.reg_name(op.reg))
         return False
 
     elif op.type == X86_OP_FP:
-        print_no_end("%f" % op.value.fp)
+        o.write("%f" % op.fp)
         return False
 
     elif op.type == X86_OP_MEM:
@@ -109,158 +121,163 @@ def print_operand(i, num_op, hexa=False):
             and inv(mm.segment) and inv(mm.index):
 
             if (mm.base == X86_REG_RBP or mm.base == X86_REG_EBP) and \
-                   var_name_exists(i, num_op): 
-                print_no_end(color_var(get_var_name(i, num_op)))
+                   var_name_exists(ctx, i, num_op): 
+                o.write(color_var(ctx, get_var_name(ctx, i, num_op)))
                 return True
             elif mm.base == X86_REG_RIP or mm.base == X86_REG_EIP:
-                print_no_end("*(" + hex(i.address + mm.disp) + ")")
+                o.write("*(" + hex(i.address + mm.disp) + ")")
                 return True
 
         printed = False
-        print_no_end("*(")
+        o.write("*(")
 
         if not inv(mm.base):
-            print_no_end("%s" % i.reg_name(mm.base))
+            o.write("%s" % i.reg_name(mm.base))
             printed = True
 
         elif not inv(mm.segment):
-            print_no_end("%s" % i.reg_name(mm.segment))
+            o.write("%s" % i.reg_name(mm.segment))
             printed = True
 
         if not inv(mm.index):
             if printed:
-                print_no_end(" + ")
+                o.write(" + ")
             if mm.scale == 1:
-                print_no_end("%s" % i.reg_name(mm.index))
+                o.write("%s" % i.reg_name(mm.index))
             else:
-                print_no_end("(%s*%d)" % (i.reg_name(mm.index), mm.scale))
+                o.write("(%s*%d)" % (i.reg_name(mm.index), mm.scale))
             printed = True
 
         if mm.disp != 0:
             if mm.disp < 0:
                 if printed:
-                    print_no_end(" - ")
-                print_no_end(-mm.disp)
+                    o.write(" - ")
+                o.write(str(-mm.disp))
             else:
                 if printed:
-                    print_no_end(" + ")
-                    print_no_end(mm.disp)
+                    o.write(" + ")
+                    o.write(str(mm.disp))
                 else:
-                    if mm.disp in binary.reverse_symbols:
-                        print_no_end(hex(mm.disp) + " ")
-                        print_symbol(mm.disp)
+                    if mm.disp in ctx.binary.reverse_symbols:
+                        o.write(hex(mm.disp) + " ")
+                        print_symbol(ctx, mm.disp)
                     else:
-                        print_no_end(hex(mm.disp))
+                        o.write(hex(mm.disp))
 
-        print_no_end(")")
+        o.write(")")
         return True
 
 
-def var_name_exists(i, op_num):
-    return i.operands[op_num].mem.disp in lib.ast.local_vars_idx
+def var_name_exists(ctx, i, op_num):
+    return i.operands[op_num].mem.disp in ctx.local_vars_idx
 
 
-def get_var_name(i, op_num):
-    idx = lib.ast.local_vars_idx[i.operands[op_num].mem.disp]
-    return lib.ast.local_vars_name[idx]
+def get_var_name(ctx, i, op_num):
+    idx = ctx.local_vars_idx[i.operands[op_num].mem.disp]
+    return ctx.local_vars_name[idx]
 
 
-def get_addr(i):
+def get_addr(ctx, i):
     addr_str = hex(i.address) + ": "
-    if i.address in addr_color:
-        addr_str = color(addr_str, addr_color[i.address])
+    if i.address in ctx.addr_color:
+        addr_str = color(ctx, addr_str, ctx.addr_color[i.address])
     else:
-        addr_str = color_addr(addr_str)
+        addr_str = color_addr(ctx, addr_str)
     return addr_str
 
 
 # Only used when --nocomment is enabled and a jump point to this instruction
-def print_addr_if_req(i, tab):
-    if i.address in addr_color:
-        print_tabbed(get_addr(i), tab)
+def print_addr_if_req(ctx, i, tab):
+    if i.address in ctx.addr_color:
+        print_tabbed(ctx, get_addr(ctx, i), tab)
 
 
-def print_comment_no_end(txt, tab=-1):
+def print_comment_no_end(ctx, txt, tab=-1):
     if tab == -1:
-        print_no_end(color_comment(txt))
+        ctx.out.write(color_comment(ctx, txt))
     else:
-        print_tabbed_no_end(color_comment(txt), tab)
+        print_tabbed_no_end(ctx, color_comment(ctx, txt), tab)
 
 
-def print_cmp_jump_commented(cmp_inst, jump_inst, tab):
-    if not nocomment:
+def print_cmp_jump_commented(ctx, cmp_inst, jump_inst, tab):
+    if not ctx.nocomment:
         if cmp_inst != None:
-            print_inst(cmp_inst, tab, "# ")
-        print_inst(jump_inst, tab, "# ")
+            print_inst(ctx, cmp_inst, tab, "# ")
+        print_inst(ctx, jump_inst, tab, "# ")
     else:
         # Otherwise print only the address if referenced
         if cmp_inst != None:
-            print_addr_if_req(cmp_inst, tab)
-        print_addr_if_req(jump_inst, tab)
+            print_addr_if_req(ctx, cmp_inst, tab)
+        print_addr_if_req(ctx, jump_inst, tab)
+
 
+def print_if_cond(ctx, cmp_inst, jump_id):
+    o = ctx.out
 
-def print_if_cond(cmp_inst, jump_id):
     if cmp_inst != None:
-        print_no_end("(")
-        print_operand(cmp_inst, 0)
-        print_no_end(" ")
+        o.write("(")
+        print_operand(ctx, cmp_inst, 0)
+        o.write(" ")
 
-    print_no_end(inst_symbol(jump_id, cmp_inst != None))
+    o.write(inst_symbol(jump_id, cmp_inst != None))
 
     if cmp_inst != None:
-        print_no_end(" ")
-        print_operand(cmp_inst, 1)
-        print_no_end(")")
+        o.write(" ")
+        print_operand(ctx, cmp_inst, 1)
+        o.write(")")
 
 
-def print_comment(txt, tab=-1):
+def print_comment(ctx, txt, tab=-1):
     if tab == -1:
-        print(color_comment(txt))
+        ctx.out.write(color_comment(ctx, txt) + "\n")
     else:
-        print_tabbed(color_comment(txt), tab)
+        print_tabbed(ctx, color_comment(ctx, txt), tab)
 
 
-def print_inst(i, tab=0, prefix=""):
+def print_inst(ctx, i, tab=0, prefix=""):
     def get_inst_str():
         nonlocal i
         return "%s %s" % (i.mnemonic, i.op_str)
 
+    o = ctx.out
+
     if prefix == "# ":
-        if not nocomment:
-            print_comment_no_end(prefix, tab)
-            print_no_end(get_addr(i))
-            print_comment(get_inst_str())
+        if not ctx.nocomment:
+            print_comment_no_end(ctx, prefix, tab)
+            o.write(get_addr(ctx, i))
+            print_comment(ctx, get_inst_str())
         return
 
-    if i.address in lib.ast.cmp_fused:
+    if i.address in ctx.cmp_fused:
         return
 
-    print_tabbed_no_end(get_addr(i), tab)
+    print_tabbed_no_end(ctx, get_addr(ctx, i), tab)
 
     if is_ret(i):
-        print(color_retcall(get_inst_str()))
+        o.write(color_retcall(ctx, get_inst_str()) + "\n")
         return
 
     if is_call(i):
-        print_no_end(color_retcall(i.mnemonic) + " ")
-        print_operand(i, 0, hexa=True)
-        print()
+        o.write(color_retcall(ctx, i.mnemonic) + " ")
+        print_operand(ctx, i, 0, hexa=True)
+        o.write("\n")
         return
 
     # Here we can have conditional jump with the option --dump
     if is_jump(i):
-        if i.operands[0].type != X86_OP_IMM:
-            print_no_end(i.mnemonic + " ")
-            print_operand(i, 0)
-            if is_uncond_jump(i) and not nocomment:
-                print_comment_no_end(" # STOPPED")
-            print()
+        if i.target == -1:
+            o.write(i.mnemonic + " ")
+            print_operand(ctx, i, 0)
+            if is_uncond_jump(i) and not ctx.nocomment:
+                print_comment_no_end(ctx, " # STOPPED")
+            o.write("\n")
             return
         try:
-            addr = i.operands[0].value.imm
-            print(i.mnemonic + " " + color(hex(addr), addr_color[addr]))
+            addr = i.target
+            o.write(i.mnemonic + " " +
+                    color(ctx, hex(addr), ctx.addr_color[addr]) + "\n")
         except Exception:
-            print(i.mnemonic + " " + hex(addr))
+            o.write(i.mnemonic + " " + hex(addr) + "\n")
         return
 
     
@@ -271,72 +288,76 @@ def print_inst(i, tab=0, prefix=""):
             X86_INS_DEC, X86_INS_INC, X86_INS_LEA, X86_INS_MOVSX, X86_INS_OR]
 
     if i.id in inst_check:
-        print_operand(i, 0)
+        print_operand(ctx, i, 0)
 
         if (all(op.type == X86_OP_REG for op in i.operands) and
-                len(set(op.value.reg for op in i.operands)) == 1 and
+                len(set(op.reg for op in i.operands)) == 1 and
                 i.id == X86_INS_XOR):
-            print_no_end(" = 0")
+            o.write(" = 0")
 
         elif i.id == X86_INS_INC or i.id == X86_INS_DEC:
-            print_no_end(inst_symbol(i.id))
+            o.write(inst_symbol(i.id))
 
         elif i.id == X86_INS_LEA:
-            print_no_end(" = &(")
-            print_operand(i, 1)
-            print_no_end(")")
+            o.write(" = &(")
+            print_operand(ctx, i, 1)
+            o.write(")")
 
         elif i.id == X86_INS_IMUL and len(i.operands) == 3:
-            print_no_end(" = ")
-            print_operand(i, 1)
-            print_no_end(" " + inst_symbol(i.id).rstrip('=') + " ")
-            print_operand(i, 2)
+            o.write(" = ")
+            print_operand(ctx, i, 1)
+            o.write(" " + inst_symbol(i.id).rstrip('=') + " ")
+            print_operand(ctx, i, 2)
 
         else:
-            print_no_end(" " + inst_symbol(i.id) + " ")
-            print_operand(i, 1)
+            o.write(" " + inst_symbol(i.id) + " ")
+            print_operand(ctx, i, 1)
 
         modified = True
 
     elif i.id == X86_INS_CDQE:
-        print_no_end("rax = eax")
+        o.write("rax = eax")
         modified = True
 
     elif i.id == X86_INS_IDIV:
-        print_no_end('eax = edx:eax / ')
-        print_operand(i, 0)
-        print_no_end('; edx = edx:eax % ')
-        print_operand(i, 0)
+        o.write('eax = edx:eax / ')
+        print_operand(ctx, i, 0)
+        o.write('; edx = edx:eax % ')
+        print_operand(ctx, i, 0)
         modified = True
 
     else:
-        print_no_end("%s " % i.mnemonic)
+        o.write("%s " % i.mnemonic)
         if len(i.operands) > 0:
-            modified = print_operand(i, 0)
+            modified = print_operand(ctx, i, 0)
             k = 1
             while k < len(i.operands):
-                print_no_end(", ")
-                modified |= print_operand(i, k)
+                o.write(", ")
+                modified |= print_operand(ctx, i, k)
                 k += 1
 
-    if modified and not nocomment:
-        print_comment_no_end(" # " + get_inst_str())
+    if modified and not ctx.nocomment:
+        print_comment_no_end(ctx, " # " + get_inst_str())
 
-    print()
+    o.write("\n")
 
 
-def print_ast(entry, ast):
-    print_no_end(color_keyword("function "))
-    print_no_end(binary.reverse_symbols.get(entry, hex(entry)))
-    print(" {")
-    print_vars_type()
-    ast.print(1)
-    print("}")
+# The function is written to fd (default sys.stdout)
+def print_ast(ctx, entry, ast, fd=None):
+    o = ctx.out
+    o.write(color_keyword(ctx, "function "))
+    o.write(ctx.binary.reverse_symbols.get(entry, hex(entry)))
+    o.write(" {\n")
+    print_vars_type(ctx)
+    ast.print(ctx, 1)
+    o.write("}\n")
+    o.flush(fd)
 
 
-def print_vars_type():
+def print_vars_type(ctx):
     idx = 0
-    for sz in lib.ast.local_vars_size:
-        name = lib.ast.local_vars_name[idx]
-        print_tabbed(color_type("int%d_t " % (sz*8)) + color_var(name), 1)
+    for sz in ctx.local_vars_size:
+        name = ctx.local_vars_name[idx]
+        print_tabbed(ctx, color_type(ctx, "int%d_t " % (sz*8)) +
+                color_var(ctx, name), 1)
         idx += 1
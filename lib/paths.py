@@ -17,63 +17,321 @@
 #
 
 
-from lib.utils import (debug__, index, is_cond_jump, is_uncond_jump,
-        BRANCH_NEXT, BRANCH_NEXT_JUMP)
-
-gph = None
-
+from bisect import bisect_right
 
+from lib.utils import (debug__, is_cond_jump, is_uncond_jump,
+        BRANCH_NEXT, BRANCH_NEXT_JUMP)
 
-def get_loop_start(curr_loop_idx):
+def get_loop_start(gph, curr_loop_idx):
     if not curr_loop_idx:
         return -1
     return gph.loops[curr_loop_idx[0]][0]
 
 
-# TODO remove
-def loop_contains(loop_start, addr):
-    if loop_start == -1:
-        return True
-    for l in gph.loops:
-        if l[0] == loop_start and addr in l:
-            return True
-    return False
-
-
-# TODO remove
-# Returns all loops starting with addr
-def loop_exists_idx(addr):
-    idx = []
-    i = 0
-    for l in gph.loops:
-        if l[0] == addr:
-            idx.append(i)
-        i += 1
-    return idx
-
-
-# TODO remove
-def loop_exists(addr):
-    # normally addr != -1
-    # nested_loops[-1] contains all sub-loops
-    # return addr in gph.nested_loops
-    for l in gph.loops:
-        if addr == l[0]:
-            return True
-    return False
+# All paths are stored in a tree : each node is an address and points to
+# the previous address of the path. Paths which have a common prefix
+# share the same nodes, so creating a new branch costs only one node.
+#
+# For the random access, each node has also a "jump" pointer to an
+# ancestor (skew-binary jumps, E. Myers "An applicative random-access
+# stack"), so the ancestor at any depth is found in O(log(depth)) steps
+# without storing the list of the nodes.
+class PathNode():
+    __slots__ = ("addr", "parent", "depth", "jump", "tree", "pre")
+
+    def __init__(self, addr, parent):
+        self.addr = addr
+        self.parent = parent
+        if parent is None:
+            self.depth = 0
+            self.jump = self
+            self.tree = PathTree()
+        else:
+            self.depth = parent.depth + 1
+            j = parent.jump
+            if parent.depth - j.depth == j.depth - j.jump.depth:
+                self.jump = j.jump
+            else:
+                self.jump = parent
+            self.tree = parent.tree
+        self.tree.add(self)
+
+
+    # Returns the node at depth on the path from the root to this node
+    def ancestor(self, depth):
+        n = self
+        while n.depth != depth:
+            if n.jump.depth >= depth:
+                n = n.jump
+            else:
+                n = n.parent
+        return n
+
+
+# The nodes of a tree and the index of the addresses. The index is built
+# on the first search, after the exploration the tree doesn't grow (the
+# paths are only cut), so it's built once.
+#
+# An address is never twice in a path, so the nodes of an address have
+# disjoint subtrees. Each node is numbered in pre-order (pre) and the
+# index gives for each address the intervals [pre, last pre of the
+# subtree] of its nodes : the node of an address on the path ending at n
+# is the one whose interval contains n.pre. It's found with a bisect.
+class PathTree():
+    __slots__ = ("nodes", "index")
+
+    def __init__(self):
+        self.nodes = []
+        self.index = None
+
+
+    def add(self, node):
+        self.nodes.append(node)
+        self.index = None
+
+
+    def build_index(self):
+        children = {}
+        for n in self.nodes:
+            if n.parent is not None:
+                if n.parent in children:
+                    children[n.parent].append(n)
+                else:
+                    children[n.parent] = [n]
+
+        # address -> ([pre], [(last, depth)]) sorted by pre
+        self.index = {}
+        counter = 0
+        stack = [(self.nodes[0], False)]
+        while stack:
+            n, done = stack.pop()
+            # The subtrees of an address are disjoint, so they are closed
+            # in the order of pre.
+            if done:
+                e = (n.pre, (counter - 1, n.depth))
+                if n.addr in self.index:
+                    lst = self.index[n.addr]
+                    lst[0].append(e[0])
+                    lst[1].append(e[1])
+                else:
+                    self.index[n.addr] = ([e[0]], [e[1]])
+                continue
+            n.pre = counter
+            counter += 1
+            stack.append((n, True))
+            for c in children.get(n, []):
+                stack.append((c, False))
+
+
+# A path is a list of addresses : the nodes from depth "start" to depth
+# "end" (excluded) of the chain ending at "node". It behaves like a list,
+# but a slice or a copy share their nodes with the original path, and
+# pop(0) only moves the start cursor.
+#
+# owners are the Paths which contain this path and count its addresses,
+# they are updated when the path is modified (a path can be in many
+# Paths, for example after a split).
+class Path():
+    __slots__ = ("node", "start", "end", "owners")
+
+    def __init__(self, addrs=[]):
+        self.node = None
+        self.start = 0
+        self.end = 0
+        self.owners = None
+        for addr in addrs:
+            self.append(addr)
+
+
+    def __len__(self):
+        return self.end - self.start
+
+
+    def __tail(self):
+        if self.end == self.node.depth + 1:
+            return self.node
+        return self.node.ancestor(self.end - 1)
+
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            start, stop, _ = k.indices(len(self))
+            if stop <= start:
+                return Path()
+            p = self.copy()
+            p.end = self.start + stop
+            p.start += start
+            return p
+
+        if k < 0:
+            k += len(self)
+        if k < 0 or k >= len(self):
+            raise IndexError("path index out of range")
+        return self.node.ancestor(self.start + k).addr
+
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+
+    def __contains__(self, addr):
+        return self.index(addr) != -1
+
+
+    def __eq__(self, other):
+        if isinstance(other, Path):
+            other = other.tolist()
+        return self.tolist() == other
+
+
+    # A path is mutable
+    __hash__ = None
+
+
+    # Returns a new list with the addresses between start and stop
+    # (relative to the beginning of the path)
+    def tolist(self, start=0, stop=-1):
+        if stop == -1:
+            stop = len(self)
+        if stop <= start:
+            return []
+        start += self.start
+        stop += self.start
+        lst = []
+        n = self.node.ancestor(stop - 1)
+        while n is not None and n.depth >= start:
+            lst.append(n.addr)
+            n = n.parent
+        lst.reverse()
+        return lst
+
+
+    # Like list.index but returns -1 if addr is not found
+    def index(self, addr, k=0):
+        if self.end == self.start:
+            return -1
+
+        # The node of addr on the path, see PathTree
+        tree = self.node.tree
+        if tree.index is None:
+            tree.build_index()
+        e = tree.index.get(addr)
+        if e is None:
+            return -1
+        pre = self.node.pre
+        i = bisect_right(e[0], pre) - 1
+        if i == -1:
+            return -1
+        last, idx = e[1][i]
+        if last < pre or idx < self.start + k or idx >= self.end:
+            return -1
+        return idx - self.start
+
+
+    # Same as index, but nothing is computed on the nodes. Used during
+    # the exploration, when paths are growing.
+    def search(self, addr, k=0):
+        found = -1
+        if self.end == self.start:
+            return found
+        n = self.__tail()
+        while n is not None and n.depth >= self.start + k:
+            if n.addr == addr:
+                found = n.depth - self.start
+            n = n.parent
+        return found
+
+
+    def __notify(self, addr, n):
+        if self.owners:
+            for paths in self.owners:
+                paths.update_count(addr, n)
+
+
+    def add_owner(self, paths):
+        if self.owners is None:
+            self.owners = [paths]
+        else:
+            self.owners.append(paths)
+
+
+    def rm_owner(self, paths):
+        self.owners.remove(paths)
+
+
+    def append(self, addr):
+        self.__notify(addr, 1)
+        if self.end == self.start:
+            self.node = PathNode(addr, None)
+            self.start = 0
+            self.end = 1
+        else:
+            self.node = PathNode(addr, self.__tail())
+            self.end += 1
+
+
+    # Only pop(0) is used (see Paths.pop)
+    def pop(self, k=0):
+        addr = self[0]
+        self.start += 1
+        self.__notify(addr, -1)
+        return addr
+
+
+    def copy(self):
+        p = Path()
+        p.node = self.node
+        p.start = self.start
+        p.end = self.end
+        return p
 
 
 class Paths():
-    def __init__(self):
+    def __init__(self, gph):
+        self.gph = gph
         self.looping = {}  # idx_path -> idx_loop
         self.paths = []
 
+        # address -> number of paths containing this address. It's built
+        # on the first use (the exploration fills self.paths directly),
+        # then the paths are registered as owned and the count is updated
+        # by each modification.
+        self.count = None
+
+
+    def update_count(self, addr, n):
+        count = self.count
+        count[addr] = count.get(addr, 0) + n
+        if count[addr] == 0:
+            del count[addr]
+
+
+    def __count_add(self, p, n=1):
+        for addr in p:
+            self.update_count(addr, n)
+
+
+    def __get_count(self):
+        if self.count is None:
+            self.count = {}
+            for p in self.paths:
+                self.__count_add(p)
+                p.add_owner(self)
+        return self.count
+
 
     def __contains__(self, addr):
-        for p in self.paths:
-            if addr in p:
-                return True
-        return False
+        return addr in self.__get_count()
+
+
+    def __set_path(self, i, p):
+        if self.count is not None:
+            old = self.paths[i]
+            self.__count_add(old, -1)
+            old.rm_owner(self)
+            self.__count_add(p)
+            p.add_owner(self)
+        self.paths[i] = p
 
 
     def contains_list(self, lst):
@@ -95,11 +353,19 @@ class Paths():
             if addr not in self:
                 return False
 
-        # Check if the loop is in the right order
+        # Check if the loop is in the right order : in each path, the
+        # addresses of the loop (until the first missing) have increasing
+        # positions. Each path is read once.
+        loop_pos = {addr: j for j, addr in enumerate(loop)}
         for p in self.paths:
+            pos = {}
+            for k, addr in enumerate(p):
+                j = loop_pos.get(addr)
+                if j is not None:
+                    pos[j] = k
             last_idx = -1
-            for addr in loop:
-                idx = index(p, addr)
+            for j in range(len(loop)):
+                idx = pos.get(j, -1)
                 if idx == -1:
                     break
                 elif idx < last_idx:
@@ -112,7 +378,7 @@ class Paths():
 
     def get_loops_idx(self):
         idx = []
-        for k, l in enumerate(gph.loops):
+        for k, l in enumerate(self.gph.loops):
             if self.__is_in_curr_loop(l):
                 idx.append(k)
         return idx
@@ -120,7 +386,7 @@ class Paths():
 
     def debug(self):
         debug__("\npaths :", end="")
-        debug__(self.paths)
+        debug__([p.tolist() for p in self.paths])
         debug__("looping :", end="")
         debug__(self.looping)
 
@@ -141,7 +407,7 @@ class Paths():
 
         # TODO not sure
         # tests/gotoinloop{6,7}
-        if addr in gph.marked_addr:
+        if addr in self.gph.marked_addr:
             if not curr_loop_idx or is_loop:
                 return False, True
 
@@ -149,15 +415,15 @@ class Paths():
             return False, False
 
         l_idx = self.looping[path_idx]
-        if addr != gph.loops[l_idx][0]:
+        if addr != self.gph.loops[l_idx][0]:
             return False, False
 
         # TODO check if all conditions are really necessary
-        if addr in gph.marked_addr: # and \
-                # l_idx in gph.marked:
+        if addr in self.gph.marked_addr: # and \
+                # l_idx in self.gph.marked:
                 # and \
-                # l_idx in gph.equiv and \
-                # gph.equiv[l_idx] not in curr_loop_idx:
+                # l_idx in self.gph.equiv and \
+                # self.gph.equiv[l_idx] not in curr_loop_idx:
             return False, True
 
         return True, False
@@ -181,6 +447,9 @@ class Paths():
 
 
     def add(self, new_path, loop_idx=-1):
+        if self.count is not None:
+            self.__count_add(new_path)
+            new_path.add_owner(self)
         idx_new_path = len(self.paths)
         self.paths.append(new_path)
         if loop_idx != -1:
@@ -191,6 +460,7 @@ class Paths():
         return self.looping.get(k, -1)
 
 
+    # The count is updated by Path.pop
     def pop(self):
         # Assume that all paths pop the same value
         for p in self.paths:
@@ -198,26 +468,21 @@ class Paths():
         return val
 
 
-    # TODO optimize suppression
-    def __del_path(self, i):
-        del self.paths[i]
-        new = {}
-        for k in self.looping:
-            if k != i:
-                if k > i:
-                    new[k-1] = self.looping[k]
-                else:
-                    new[k] = self.looping[k]
-        del self.looping
-        self.looping = new
-
-
+    # Removes all empty paths in one pass, the indexes in self.looping
+    # are remapped to the new positions. Empty paths are not counted in
+    # self.count, so it doesn't change.
     def rm_empty_paths(self):
-        i = len(self.paths) - 1
-        while i >= 0:
-            if not self.paths[i]:
-                self.__del_path(i)
-            i -= 1
+        paths = []
+        looping = {}
+        for k, p in enumerate(self.paths):
+            if p:
+                if k in self.looping:
+                    looping[len(paths)] = self.looping[k]
+                paths.append(p)
+            elif self.count is not None:
+                p.rm_owner(self)
+        self.paths = paths
+        self.looping = looping
         return len(self.paths) == 0
 
 
@@ -256,8 +521,8 @@ class Paths():
                 return last, is_loop, False, (force_stop and addr0)
 
             # Check addr0
-            if is_cond_jump(gph.nodes[addr0][0]):
-                nxt = gph.link_out[addr0]
+            if is_cond_jump(self.gph.nodes[addr0][0]):
+                nxt = self.gph.link_out[addr0]
                 c1 = self.loop_contains(curr_loop_idx, nxt[BRANCH_NEXT])
                 c2 = self.loop_contains(curr_loop_idx, nxt[BRANCH_NEXT_JUMP])
                 if c1 and c2:
@@ -271,7 +536,7 @@ class Paths():
                     i += 1
                     continue
 
-                if index(self.paths[i], addr0) == -1:
+                if self.paths[i].index(addr0) == -1:
                     return last, False, False, 0
 
                 addr = self.paths[i][k]
@@ -281,8 +546,8 @@ class Paths():
                     return last, is_loop, False, force_stop and addr
 
 
-                if is_cond_jump(gph.nodes[addr][0]):
-                    nxt = gph.link_out[addr]
+                if is_cond_jump(self.gph.nodes[addr][0]):
+                    nxt = self.gph.link_out[addr]
                     c1 = self.loop_contains(curr_loop_idx, nxt[BRANCH_NEXT])
                     c2 = self.loop_contains(curr_loop_idx, nxt[BRANCH_NEXT_JUMP])
                     if c1 and c2:
@@ -348,7 +613,7 @@ class Paths():
             while i < len(self.paths):
                 if i != refpath:
                     if not self.__is_looping(i, curr_loop_idx):
-                        if index(self.paths[i], val) == -1:
+                        if self.paths[i].index(val) == -1:
                             found = False
                             break
                 i += 1
@@ -360,8 +625,8 @@ class Paths():
 
 
     def split(self, ifaddr, endpoint):
-        nxt = gph.link_out[ifaddr]
-        split = [Paths(), Paths()]
+        nxt = self.gph.link_out[ifaddr]
+        split = [Paths(self.gph), Paths(self.gph)]
         else_addr = -1
         for k, p in enumerate(self.paths):
             if p:
@@ -373,7 +638,7 @@ class Paths():
                 # idx == -1 means :
                 # - p is looping so there is no endpoint with some other paths
                 # - endpoint == -1
-                idx = index(p, endpoint)
+                idx = p.index(endpoint)
                 if idx == -1:
                     split[br].add(p, self.__get_loop_idx(k))
                 else:
@@ -384,8 +649,8 @@ class Paths():
     def goto_addr(self, addr):
         i = 0
         while i < len(self.paths):
-            idx = index(self.paths[i], addr)
-            self.paths[i] = [] if idx == -1 else self.paths[i][idx:]
+            idx = self.paths[i].index(addr)
+            self.__set_path(i, Path() if idx == -1 else self.paths[i][idx:])
             i += 1
 
 
@@ -397,7 +662,7 @@ class Paths():
         if not loop_start_idx:
             return True
         for i in loop_start_idx:
-            if addr in gph.loops[i]:
+            if addr in self.gph.loops[i]:
                 return True
         return False
                     
@@ -420,10 +685,10 @@ class Paths():
             return True, False
 
         for i in curr_loop_idx:
-            if l_idx in gph.nested_loops_idx[i]:
+            if l_idx in self.gph.nested_loops_idx[i]:
                 return True, False
 
-        if l_idx in gph.marked:
+        if l_idx in self.gph.marked:
             return False, True
 
         return False, False
@@ -434,10 +699,10 @@ class Paths():
     def extract_loop_paths(self, curr_loop_idx):
         # TODO optimize....
 
-        loop_paths = Paths()
+        loop_paths = Paths(self.gph)
 
         # temporary, it will be replaced later by an array of Paths
-        endloop = Paths()
+        endloop = Paths(self.gph)
 
         # ------------------------------------------------------
         # Separation of loop-paths / endloops
@@ -459,9 +724,9 @@ class Paths():
                 if addr not in loop_paths:
                     p = el[k:]
                     if p not in endloop.paths:
-                        endloop.paths[i] = p
+                        endloop.__set_path(i, p)
                     else:
-                        endloop.paths[i] = []
+                        endloop.__set_path(i, Path())
                     break
 
         endloop.rm_empty_paths()
@@ -479,7 +744,7 @@ class Paths():
                 for el in endloop.paths:
                     if el[0] == p[0]:
                         continue
-                    idx = index(el, addr)
+                    idx = el.index(addr)
                     if idx != -1:
                         common[addr] = True
                         break
@@ -488,9 +753,9 @@ class Paths():
             for i, el in enumerate(endloop.paths):
                 if el[0] == dup:
                     continue
-                idx = index(el, dup)
+                idx = el.index(dup)
                 if idx != -1:
-                    endloop.paths[i] = el[:idx]
+                    endloop.__set_path(i, el[:idx])
                     if idx != len(el)-1 and i in self.looping:
                         del endloop.looping[i]
 
@@ -510,7 +775,7 @@ class Paths():
                 grp_endloop[idx].add(el, endloop.__get_loop_idx(k))
             except:
                 seen[el[0]] = len(grp_endloop) # save index
-                p = Paths()
+                p = Paths(self.gph)
                 p.add(el, endloop.__get_loop_idx(k))
                 grp_endloop.append(p)
 
@@ -528,13 +793,13 @@ class Paths():
 
             for el in els.paths:
                 queue = el[-1]
-                inst = gph.nodes[queue][0]
+                inst = self.gph.nodes[queue][0]
                 if not is_uncond_jump(inst):
                     try:
                         # TODO
                         # is it possible to have a conditional jump here ?
                         # if true, need to check BRANCH_NEXT_JUMP
-                        no_jump[i] = gph.link_out[queue][BRANCH_NEXT]
+                        no_jump[i] = self.gph.link_out[queue][BRANCH_NEXT]
                     except:
                         no_jump[i] = -1
                     all_jmp = False
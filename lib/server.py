@@ -0,0 +1,170 @@
+#
+# Reverse : reverse engineering for x86 binaries
+# Copyright (C) 2015    Joel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.    If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Server mode (reverse.py --server SOCKET). The loaded binaries are kept
+# between the requests, so only the first analysis of a file pays the
+# parsing of the binary and the loading of symbols.
+#
+# A request is a json object sent on a unix socket :
+#     {"argv": [arguments of reverse.py], "cwd": "/current/dir"}
+# The client must close its side of the socket after the request. The
+# response is :
+#     {"stdout": "...", "stderr": "...", "status": exit code}
+#
+# See revclient.py.
+
+import io
+import os
+import sys
+import json
+import signal
+import socket
+import traceback
+from collections import OrderedDict
+
+from lib.disassembler import Disassembler
+from lib.utils import die
+
+
+# Maximum number of binaries kept in memory
+MAX_BINARIES = 8
+
+
+# LRU of disassemblers : (path, raw_bits, cache_dir) -> (mtime, size,
+# Disassembler). If the file is modified it's loaded again.
+class DisassemblerLRU():
+    def __init__(self, size):
+        self.size = size
+        self.__dis = OrderedDict()
+        self.__last = None
+
+
+    def get(self, filename, raw_bits, cache_dir):
+        if cache_dir is not None:
+            cache_dir = os.path.abspath(cache_dir)
+        key = (os.path.abspath(filename), raw_bits, cache_dir)
+        st = os.stat(filename)
+        stamp = (st.st_mtime_ns, st.st_size)
+
+        self.__last = key
+        e = self.__dis.get(key)
+        if e is not None and e[0] == stamp:
+            self.__dis.move_to_end(key)
+            return e[1]
+
+        dis = Disassembler(filename, raw_bits, cache_dir)
+        self.__dis[key] = (stamp, dis)
+        self.__dis.move_to_end(key)
+        if len(self.__dis) > self.size:
+            self.__dis.popitem(last=False)
+        return dis
+
+
+    # Called if the last request failed, the disassembler may be in an
+    # incoherent state.
+    def drop_last(self):
+        self.__dis.pop(self.__last, None)
+        self.__last = None
+
+
+def recv_all(conn):
+    data = []
+    while True:
+        buf = conn.recv(65536)
+        if not buf:
+            break
+        data.append(buf)
+    return b"".join(data)
+
+
+# Run reverse(argv, disassemblers) and returns the response. The
+# standard outputs are captured, an exit (die, argparse) gives the
+# status code.
+def run_request(req, reverse, disassemblers):
+    out = io.StringIO()
+    err = io.StringIO()
+    stdout = sys.stdout
+    stderr = sys.stderr
+    sys.stdout = out
+    sys.stderr = err
+    status = 0
+
+    try:
+        os.chdir(req["cwd"])
+        reverse(req["argv"], disassemblers)
+    except SystemExit as e:
+        if e.code is None:
+            status = 0
+        elif isinstance(e.code, int):
+            status = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            status = 1
+    except Exception:
+        traceback.print_exc()
+        disassemblers.drop_last()
+        status = 1
+    finally:
+        sys.stdout = stdout
+        sys.stderr = stderr
+
+    return {
+        "stdout": out.getvalue(),
+        "stderr": err.getvalue(),
+        "status": status,
+    }
+
+
+def serve(path, reverse):
+    if os.path.exists(path):
+        os.unlink(path)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.bind(path)
+    except OSError as e:
+        die("can't bind %s (%s)" % (path, e.strerror))
+    sock.listen(16)
+
+    # The socket is removed in the finally
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    disassemblers = DisassemblerLRU(MAX_BINARIES)
+
+    try:
+        while True:
+            conn, _ = sock.accept()
+            with conn:
+                try:
+                    req = json.loads(recv_all(conn).decode())
+                    resp = run_request(req, reverse, disassemblers)
+                except (ValueError, KeyError) as e:
+                    resp = {
+                        "stdout": "",
+                        "stderr": "ERROR: bad request (%s)\n" % e,
+                        "status": 1,
+                    }
+                try:
+                    conn.sendall(json.dumps(resp).encode())
+                except OSError:
+                    pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+        os.unlink(path)
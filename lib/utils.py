@@ -18,7 +18,6 @@
 #
 
 import sys
-from capstone import CS_GRP_CALL, CS_GRP_JUMP, CS_GRP_RET
 from capstone.x86 import (X86_INS_ADD, X86_INS_AND, X86_INS_CMP, X86_INS_DEC,
         X86_INS_IMUL, X86_INS_INC, X86_INS_JA, X86_INS_JAE, X86_INS_JE,
         X86_INS_JGE, X86_INS_JL, X86_INS_JLE, X86_INS_JG, X86_INS_JBE,
@@ -27,6 +26,8 @@ from capstone.x86 import (X86_INS_ADD, X86_INS_AND, X86_INS_CMP, X86_INS_DEC,
         X86_INS_JP, X86_INS_JRCXZ, X86_INS_JS, X86_INS_MOV, X86_INS_SHL,
         X86_INS_SHR, X86_INS_SUB, X86_INS_XOR, X86_INS_OR, X86_INS_MOVSX)
 
+from lib.instruction import FLAG_CALL, FLAG_COND_JUMP, FLAG_JUMP, FLAG_RET
+
 # X86_INS_JAE = 257
 # X86_INS_JA = 258
 # X86_INS_JBE = 259
@@ -82,21 +83,23 @@ PRINTABLE[13] = r'\r'
 get_char = PRINTABLE.__getitem__
 
 
+# i is a lib.instruction.Instruction
+
 def is_jump(i):
-    return i.group(CS_GRP_JUMP)
+    return i.flags & FLAG_JUMP != 0
 
 def is_cond_jump(i):
-    return i.group(CS_GRP_JUMP) and i.id != X86_INS_JMP
+    return i.flags & FLAG_COND_JUMP != 0
 
 def is_uncond_jump(i):
     return i.id == X86_INS_JMP
 
 def is_ret(i):
     # TODO more ret  ??
-    return i.group(CS_GRP_RET)
+    return i.flags & FLAG_RET != 0
 
 def is_call(i):
-    return i.group(CS_GRP_CALL)
+    return i.flags & FLAG_CALL != 0
 
 
 OPPOSITES = [
@@ -234,6 +237,10 @@ def error(txt):
     print("ERROR: " + txt, file=sys.stderr)
 
 
+def warning(txt):
+    print("WARNING: " + txt, file=sys.stderr)
+
+
 def die(txt):
     print("ERROR: " + txt, file=sys.stderr)
     sys.exit(1)
@@ -15,6 +15,15 @@ if [ "$1" == "force" ]; then
   mv tests/pendu.rev tests/pendu__main.rev
   ./reverse.py tests/pendu.bin -x=___main -ns -nc >tests/pendu____main.rev
 
+  # Tests of options (see OPT_REV in the Makefile)
+  ./reverse.py tests/if4.bin --maxpaths 2 -ns -nc >tests/if4.maxpaths.rev 2>tests/err
+  cat tests/err >>tests/if4.maxpaths.rev
+  rm tests/err
+  ./reverse.py tests/server.bin --json -x connection_handler -ns -nc >tests/server.json.rev
+  ./reverse.py tests/server.bin --all -ns -nc >tests/server.all.rev 2>tests/err
+  cat tests/err >>tests/server.all.rev
+  rm tests/err
+
 else
     echo "Are you sure ?"
     echo "if yes add 'force' in argument"
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+#
+# Reverse : reverse engineering for x86 binaries
+# Copyright (C) 2015    Joel
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.    If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Client of reverse.py --server. It takes the same arguments as
+# reverse.py, the socket is given by the environment variable
+# REVERSE_SOCKET :
+#
+#   ./reverse.py --server /tmp/reverse.sock &
+#   export REVERSE_SOCKET=/tmp/reverse.sock
+#   ./revclient.py tests/server.bin -x connection_handler
+#
+# If there is no server, reverse.py is executed.
+#
+# Only the standard library is imported here, the startup must be fast.
+
+import os
+import sys
+import json
+import socket
+
+
+def run_local():
+    rev = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       "reverse.py")
+    os.execv(sys.executable, [sys.executable, rev] + sys.argv[1:])
+
+
+def main():
+    path = os.environ.get("REVERSE_SOCKET")
+    if not path:
+        run_local()
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        run_local()
+
+    req = {"argv": sys.argv[1:], "cwd": os.getcwd()}
+    sock.sendall(json.dumps(req).encode())
+    sock.shutdown(socket.SHUT_WR)
+
+    data = []
+    while True:
+        buf = sock.recv(65536)
+        if not buf:
+            break
+        data.append(buf)
+    sock.close()
+
+    resp = json.loads(b"".join(data).decode())
+    sys.stderr.write(resp["stderr"])
+    sys.stdout.write(resp["stdout"])
+    sys.exit(resp["status"])
+
+
+if __name__ == '__main__':
+    main()
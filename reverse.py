@@ -17,6 +17,7 @@
 # along with this program.    If not, see <http://www.gnu.org/licenses/>.
 #
 
+import io
 import sys
 import os
 import os.path
@@ -24,22 +25,204 @@ from argparse import ArgumentParser, FileType
 
 import lib.ast
 import lib.output
-import lib.colors
-import lib.fileformat.binary
-import lib.paths
-from lib.utils import die
+from lib.utils import die, error
+from lib.context import DecompileContext
 from lib.disassembler import Disassembler
 from lib.generate_ast import generate_ast
-from lib.vim import generate_vim_syntax
 
 
+def analyze(dis, addr, options):
+    ctx = DecompileContext(dis, dis.get_graph(addr, options), options)
+    return ctx, generate_ast(ctx)
 
-def reverse():
+
+# Decompile the function at addr. print_function is lib.output.print_ast
+# or lib.json_output.print_json. Returns the output and the errors
+# printed, so the results of each function can be printed in order.
+# If the function fails, the output is empty. The instructions decoded
+# by a worker of -j are returned too, for the cache.
+def reverse_function(dis, options, print_function, addr):
+    out = io.StringIO()
+    err = io.StringIO()
+    stderr = sys.stderr
+    sys.stderr = err
+
+    try:
+        dis.disasm(addr, lazy=True)
+        ctx, ast = analyze(dis, addr, options)
+        print_function(ctx, addr, ast, out)
+    except SystemExit:
+        error("0x%x: the function is skipped" % addr)
+        out = None
+    except KeyError as e:
+        # The key is an address if an instruction is missing
+        key = e.args[0] if e.args else None
+        if isinstance(key, int):
+            error("0x%x: no instruction at 0x%x, the function is skipped" %
+                    (addr, key))
+        else:
+            error("0x%x: KeyError %r, the function is skipped" % (addr, key))
+        out = None
+    except Exception as e:
+        error("0x%x: %s, the function is skipped" % (addr, e))
+        out = None
+    finally:
+        sys.stderr = stderr
+
+    code = None if dis.new_code is None else dis.pop_new_code()
+    return ("" if out is None else out.getvalue()), err.getvalue(), code
+
+
+# Arguments of reverse_function in a worker of -j, set by init_worker.
+# The workers are forked, so they share the loaded binary and nothing is
+# pickled. It's never set in the main process.
+worker_args = None
+
+
+def init_worker(*args):
+    global worker_args
+    worker_args = args
+
+
+def run_worker(addr):
+    return reverse_function(*worker_args, addr)
+
+
+# Decompile all functions of the binary, in jobs processes. If a
+# function fails, the error is printed and the next one is analyzed.
+def reverse_all(dis, jobs, options, print_function):
+    functions = dis.get_functions()
+
+    if jobs > 1:
+        # The workers send back the instructions they decode
+        if dis.binary.cache is not None:
+            dis.new_code = []
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        ctx = multiprocessing.get_context("fork")
+        pool = ProcessPoolExecutor(max_workers=jobs, mp_context=ctx,
+                initializer=init_worker,
+                initargs=(dis, options, print_function))
+        results = pool.map(run_worker, functions,
+                chunksize=max(1, len(functions) // (jobs * 4)))
+    else:
+        pool = None
+        results = (reverse_function(dis, options, print_function, addr)
+                   for addr in functions)
+
+    first = True
+    for out, err, code in results:
+        if code is not None:
+            dis.add_code(code)
+        sys.stderr.write(err)
+        if not out:
+            continue
+        # The json output is one line per function
+        if not first and print_function is lib.output.print_ast:
+            print()
+        first = False
+        sys.stdout.write(out)
+
+    if pool is not None:
+        pool.shutdown()
+    dis.new_code = None
+
+
+# Options of the analysis given to Disassembler.get_graph and to
+# DecompileContext, so each run (or request of the server) has its own.
+def get_options(args):
+    return {
+        "nocolor": args.nocolor,
+        "vim": args.vim,
+        "nocomment": args.nocomment,
+        "nosectionsname": args.nosectionsname,
+        "print_andif": not args.noandif,
+        "datasize": args.datasize,
+        "forcejmp": args.forcejmp,
+        "maxpaths": args.maxpaths,
+        "maxtime": args.maxtime,
+        "maxmem": args.maxmem,
+    }
+
+
+def reverse_file(args, dis, raw_bits):
+    options = get_options(args)
+
+    if args.json:
+        from lib.json_output import print_json
+        print_function = print_json
+    else:
+        print_function = lib.output.print_ast
+
+    if args.symfile:
+        dis.load_user_sym_file(args.symfile)
+
+    # Maybe args.entry is a symbol and doesn't exist.
+    # But we need an address for disassembling. After that, if the file 
+    # is PE we load imported symbols and search in the code for calls.
+    if args.sym or args.call or args.all or args.entry == "EP":
+        addr = dis.binary.get_entry_point()
+    else:
+        addr = dis.get_addr_from_string(args.entry, raw_bits)
+
+    # Disassemble and load imported symbols for PE. The whole section
+    # is disassembled only if we need to print all calls, otherwise
+    # instructions are decoded on demand.
+    dis.disasm(addr, lazy=not args.call)
+
+    if args.call:
+        dis.print_calls(DecompileContext(dis, options=options))
+        return
+
+    if args.sym:
+        dis.print_symbols()
+        return
+
+    if args.all:
+        reverse_all(dis, args.jobs, options, print_function)
+        return
+
+    if args.dump:
+        ctx = DecompileContext(dis, options=options)
+        if args.vim:
+            from lib.vim import generate_vim_syntax
+            base = os.path.basename(args.filename)
+            ctx.nocolor = True
+            with open(base + ".rev", "w+") as fd:
+                dis.dump(ctx, addr, args.lines, fd)
+            generate_vim_syntax(ctx, base + ".vim")
+            print("Run :  vim {0}.rev -S {0}.vim".format(base), file=sys.stderr)
+        else:
+            dis.dump(ctx, addr, args.lines)
+        return
+
+    ctx, ast = analyze(dis, addr, options)
+
+    if args.graph:
+        ctx.gph.html_graph()
+
+    if args.vim:
+        from lib.vim import generate_vim_syntax
+        base = os.path.basename(args.filename)
+        # The colors are in the .vim file
+        ctx.nocolor = True
+        generate_vim_syntax(ctx, base + ".vim")
+        with open(base + ".rev", "w+") as fd:
+            lib.output.print_ast(ctx, addr, ast, fd)
+        print("Run :  vim {0}.rev -S {0}.vim".format(base), file=sys.stderr)
+    else:
+        print_function(ctx, addr, ast)
+
+
+# argv is None for the command line. The server gives the arguments of
+# the client and disassemblers (see lib/server.py) to reuse the binaries
+# already loaded.
+def reverse(argv=None, disassemblers=None):
     # Parse arguments
     parser = ArgumentParser(description=
         'Reverse engineering for x86 binaries. Generation of pseudo-C. '
         'Supported formats : ELF, PE. https://github.com/joelpx/reverse')
-    parser.add_argument('filename', metavar='FILENAME')
+    parser.add_argument('filename', metavar='FILENAME', nargs='?')
     parser.add_argument('-nc', '--nocolor', action='store_true')
     parser.add_argument('-g', '--graph', action='store_true',
             help='Generate an html flow graph. See d3/index.html.')
@@ -72,17 +255,47 @@ def reverse():
     parser.add_argument('-ns', '--nosectionsname', action='store_true')
     parser.add_argument('--forcejmp', action='store_true',
             help=('Try to disassemble if a "jmp [ADDR]" or jmp rax is found.'))
+    parser.add_argument('--maxpaths', type=int, default=100000, metavar='N',
+            help=('default 100000, if a function has more paths it is printed '
+            'with gotos, 0 means no limit.'))
+    parser.add_argument('--maxtime', type=int, default=0, metavar='SECONDS',
+            help='Maximum time to analyze a function, 0 means no limit.')
+    parser.add_argument('--maxmem', type=int, default=0, metavar='MB',
+            help='Maximum memory used to analyze a function, 0 means no limit.')
+    parser.add_argument('--all', action='store_true',
+            help='Decompile all functions (symbols in executable sections).')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+            help='default 1, number of processes used with --all.')
+    parser.add_argument('--cache', metavar='DIR',
+            help=('Save the symbols and the disassembled code in DIR, '
+            'the next analysis of the same file will be faster.'))
+
+    parser.add_argument('--json', action='store_true',
+            help=('Print the ast in json instead of the pseudo-C, one line '
+            'per function.'))
+    parser.add_argument('--server', metavar='SOCKET',
+            help=('Run as a server on the unix socket SOCKET, loaded '
+            'binaries are kept in memory. See revclient.py.'))
+
+    args = parser.parse_args(argv)
+
+    # The arguments of a client are run in the server, it can't start
+    # another server.
+    if disassemblers is not None and args.server:
+        parser.error("--server can't be used by a client")
+
+    if args.server:
+        from lib.server import serve
+        serve(args.server, reverse)
+        return
+
+    if args.filename is None:
+        parser.error("the following arguments are required: FILENAME")
 
-    args = parser.parse_args()
+    if args.jobs != 1 and not args.all:
+        parser.error("-j/--jobs can be used only with --all")
 
-    lib.utils.dbg                         = args.opt_debug
-    lib.disassembler.forcejmp             = args.forcejmp
-    lib.generate_ast.print_andif          = not args.noandif
-    lib.colors.nocolor                    = args.nocolor
-    lib.output.nocomment                  = args.nocomment
-    lib.output.nosectionsname             = args.nosectionsname
-    lib.ast.nocomment                     = args.nocomment
-    lib.fileformat.binary.MAX_STRING_DATA = args.datasize
+    lib.utils.dbg = args.opt_debug
 
     if not os.path.exists(args.filename):
         die("{args.filename} doesn't exist".format(args=args))
@@ -96,68 +309,14 @@ def reverse():
     else:
         raw_bits = 0
 
-    dis = Disassembler(args.filename, raw_bits)
-
-    if args.symfile:
-        dis.load_user_sym_file(args.symfile)
-
-    # Maybe args.entry is a symbol and doesn't exist.
-    # But we need an address for disassembling. After that, if the file 
-    # is PE we load imported symbols and search in the code for calls.
-    if args.sym or args.call or args.entry == "EP":
-        addr = dis.binary.get_entry_point()
+    # The user symbols are added to the binary, so it's not shared
+    if disassemblers is None or args.symfile:
+        dis = Disassembler(args.filename, raw_bits, args.cache)
     else:
-        addr = dis.get_addr_from_string(args.entry, raw_bits)
+        dis = disassemblers.get(args.filename, raw_bits, args.cache)
 
-    # Disassemble and load imported symbols for PE
-    dis.disasm(addr)
-
-    lib.output.binary = dis.binary
-    lib.ast.binary    = dis.binary
-
-    if args.call:
-        dis.print_calls()
-        return
-
-    if args.sym:
-        dis.print_symbols()
-        return
-
-    if args.dump:
-        if args.vim:
-            base = os.path.basename(args.filename)
-            lib.colors.nocolor = True
-            sys.stdout = open(base + ".rev", "w+")
-        dis.dump(addr, args.lines)
-        if args.vim:
-            generate_vim_syntax(base + ".vim")
-            print("Run :  vim {0}.rev -S {0}.vim".format(base), file=sys.stderr)
-        return
-
-    gph = dis.get_graph(addr)
-
-    lib.output.gph    = gph
-    lib.ast.gph       = gph
-    lib.paths.gph     = gph
-    lib.ast.dis       = dis
-
-    if args.graph:
-        gph.html_graph()
-
-    ast = generate_ast(gph)
-
-    if args.vim:
-        base = os.path.basename(args.filename)
-        # re-assign if no colors
-        lib.ast.assign_colors(ast)
-        lib.colors.nocolor = True
-        generate_vim_syntax(base + ".vim")
-        sys.stdout = open(base + ".rev", "w+")
-
-    lib.output.print_ast(addr, ast)
-
-    if args.vim:
-        print("Run :  vim {0}.rev -S {0}.vim".format(base), file=sys.stderr)
+    reverse_file(args, dis, raw_bits)
+    dis.save_cache()
 
 
 if __name__ == '__main__':